@@ -1,21 +1,32 @@
 """Module to fetch current prices for Kraken currency pairs and write them to InfluxDB."""
 
-from typing import Dict, List
+from typing import Dict, List, Optional, Union
+from urllib.parse import quote
 from pycoingecko import CoinGeckoAPI
-from influxdb import InfluxDBClient
+from file_cache import JsonFileCache, cache_path
+from influx_writer import BatchWriter, create_writer
+from rate_limit import Backoff, TokenBucket
 import os
 import time
 
+# Per-coin fields requested from CoinGecko.
+PRICE_FIELDS = ("usd", "usd_24h_vol", "usd_market_cap")
+
+# Limits on the ids sent in one get_price call, keeping the URL well under
+# common 2 KB request-line limits.
+MAX_IDS_PER_CALL = 250
+MAX_IDS_CHARS = 1500
+
+# Measurement for the one-point-per-coin layout.
+TAGGED_MEASUREMENT = "allcrypto_by_symbol"
 
-def get_influxdb_client() -> InfluxDBClient:
-    """Create and return an InfluxDB client using environment variables."""
-    return InfluxDBClient(
-        host=os.getenv("INFLUX_HOSTNAME"),
-        port=8086,
-        username=os.getenv("INFLUX_USERNAME"),
-        password=os.getenv("INFLUX_PASSWORD"),
-        database=os.getenv("INFLUX_DATABASE"),
-    )
+
+def get_schema() -> str:
+    """Returns the point layout selected by ``ALLCRYPTO_SCHEMA``."""
+    schema = os.getenv("ALLCRYPTO_SCHEMA", "wide")
+    if schema not in ("wide", "tagged", "both"):
+        raise ValueError(f"Unknown ALLCRYPTO_SCHEMA {schema!r}")
+    return schema
 
 
 def get_kraken_crypto_symbols() -> List[str]:
@@ -103,52 +114,324 @@ def get_kraken_gecko_mapping(
     return mapping
 
 
-def fetch_and_write_crypto_data(
-    client: InfluxDBClient, cg: CoinGeckoAPI, mapping: Dict[str, str]
-):
-    """Fetches crypto data and writes it to InfluxDB.
+def build_points(
+    prices: Dict[str, Dict[str, float]],
+    reverse_mapping: Dict[str, str],
+    schema: str = "wide",
+) -> List[Dict]:
+    """Builds InfluxDB points from a CoinGecko price response in one pass.
 
     Args:
-        client: An InfluxDB client instance.
-        cg: A CoinGeckoAPI client instance.
-        mapping: A mapping of Kraken to CoinGecko symbols.
+        prices: The ``get_price`` response, keyed by CoinGecko id.
+        reverse_mapping: A mapping of CoinGecko to Kraken symbols.
+        schema: "wide" for one ``allcrypto`` point with three fields per coin,
+            "tagged" for one ``allcrypto_by_symbol`` point per coin with a
+            ``symbol`` tag, or "both".
+
+    Returns:
+        A list of points.
     """
-    reverse_mapping = {v: k for k, v in mapping.items()}
+    wide = schema in ("wide", "both")
+    tagged = schema in ("tagged", "both")
+    data: Dict[str, float] = {}
+    points: List[Dict] = []
 
-    while True:
-        prices = cg.get_price(
-            ids=list(mapping.values()),
-            vs_currencies="usd",
-            include_market_cap="true",
-            include_24hr_vol="true",
+    for gecko_id, values in prices.items():
+        symbol = reverse_mapping[gecko_id]
+        fields = {field: values[field] for field in PRICE_FIELDS if field in values}
+        if wide:
+            for field, value in fields.items():
+                data[f"{symbol}.{field}"] = value
+        if tagged and fields:
+            points.append(
+                {
+                    "measurement": TAGGED_MEASUREMENT,
+                    "tags": {"symbol": symbol},
+                    "fields": fields,
+                }
+            )
+
+    if wide and data:
+        points.insert(0, {"measurement": "allcrypto", "fields": data})
+    return points
+
+
+def chunk_ids(
+    ids: List[str], max_ids: int = MAX_IDS_PER_CALL, max_chars: int = MAX_IDS_CHARS
+) -> List[List[str]]:
+    """Splits CoinGecko ids into as few ``get_price`` calls as the limits allow.
+
+    Args:
+        ids: CoinGecko ids to fetch.
+        max_ids: Maximum number of ids per call.
+        max_chars: Maximum URL-encoded length of the ``ids`` parameter.
+
+    Returns:
+        Lists of ids, one per call.
+    """
+    chunks: List[List[str]] = []
+    chunk: List[str] = []
+    length = 0
+    for gecko_id in ids:
+        # Each id after the first is preceded by an encoded comma.
+        cost = len(quote(gecko_id)) + (3 if chunk else 0)
+        if chunk and (len(chunk) >= max_ids or length + cost > max_chars):
+            chunks.append(chunk)
+            chunk, length, cost = [], 0, len(quote(gecko_id))
+        chunk.append(gecko_id)
+        length += cost
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def get_status_code(error: Exception) -> Optional[int]:
+    """Extracts the HTTP status from an error raised by pycoingecko, if any.
+
+    pycoingecko raises ``HTTPError`` for plain error responses and
+    ``ValueError`` carrying the decoded body when the error body is JSON.
+    """
+    response = getattr(error, "response", None)
+    if response is not None:
+        return response.status_code
+    if error.args and isinstance(error.args[0], dict):
+        status = error.args[0].get("status", {})
+        if isinstance(status, dict):
+            return status.get("error_code")
+    return None
+
+
+class CryptoPoller:
+    """Polls CoinGecko prices within the API's rate limit.
+
+    Ids are fetched in chunks, each call taking a token from a bucket sized
+    to ``COINGECKO_CALLS_PER_MINUTE``. The poll interval never drops below
+    the time the bucket needs to refill one full cycle of chunks, which is
+    the highest freshness the limit sustains. HTTP 429 and 5xx responses
+    trigger an exponential backoff and lengthen the poll interval, which
+    then shrinks back towards the minimum while calls succeed. Prices from
+    the chunks that did succeed are still written.
+    """
+
+    def __init__(
+        self,
+        cg: CoinGeckoAPI,
+        mapping: Union[Dict[str, str], JsonFileCache],
+        schema: str = "wide",
+        min_interval: float = 10.0,
+        max_interval: float = 300.0,
+        calls_per_minute: float = 10.0,
+    ):
+        """
+        Args:
+            cg: A CoinGeckoAPI client instance.
+            mapping: A mapping of Kraken to CoinGecko symbols, or a cache
+                holding one; a cached mapping is re-read before every poll
+                so background refreshes take effect.
+            schema: Point layout, see ``build_points``.
+            min_interval: Shortest time between polls, in seconds.
+            max_interval: Longest time between polls, in seconds.
+            calls_per_minute: Sustained call rate the API allows.
+        """
+        self.cg = cg
+        self.mapping_cache = mapping if isinstance(mapping, JsonFileCache) else None
+        self.schema = schema
+        self.calls_per_minute = calls_per_minute
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self.interval = min_interval
+        initial: Dict[str, str] = (
+            self.mapping_cache.get() if self.mapping_cache else mapping  # type: ignore
         )
-        data = {f"{reverse_mapping[k]}.usd": v["usd"] for k, v in prices.items()}
-        data.update(
-            {
-                f"{reverse_mapping[k]}.usd_24h_vol": v["usd_24h_vol"]
-                for k, v in prices.items()
-            }
+        self.bucket = TokenBucket(
+            calls_per_minute / 60, max(1, len(chunk_ids(list(initial.values()))))
         )
-        data.update(
-            {
-                f"{reverse_mapping[k]}.usd_market_cap": v["usd_market_cap"]
-                for k, v in prices.items()
-            }
+        self._mapping: Optional[Dict[str, str]] = None
+        self._set_mapping(initial)
+        self.backoff = Backoff(base=self.min_interval, maximum=self.max_interval)
+        self.next_poll = 0.0
+
+        self.cycles = 0
+        self.skipped_cycles = 0
+        self.partial_cycles = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.delay = 0.0
+
+    def poll(self, writer: BatchWriter) -> None:
+        """Fetches prices if a poll is due and writes them with poller metrics.
+
+        Args:
+            writer: A BatchWriter instance.
+        """
+        now = time.monotonic()
+        if now < self.next_poll:
+            return
+        if self.mapping_cache:
+            mapping = self.mapping_cache.get()
+            if mapping is not self._mapping:
+                self._set_mapping(mapping)
+        if self.backoff.remaining() or not self.bucket.try_acquire(len(self.chunks)):
+            self.skipped_cycles += 1
+            self.next_poll = now + max(
+                self.backoff.remaining(), self.bucket.wait_time(len(self.chunks))
+            )
+            self._write_metrics(writer)
+            return
+        self.delay = max(0.0, now - self.next_poll) if self.next_poll else 0.0
+
+        prices: Dict[str, Dict[str, float]] = {}
+        failed = 0
+        for chunk in self.chunks:
+            try:
+                prices.update(
+                    self.cg.get_price(
+                        ids=chunk,
+                        vs_currencies="usd",
+                        include_market_cap="true",
+                        include_24hr_vol="true",
+                    )
+                )
+            except Exception as e:
+                failed += 1
+                if not self._handle_error(e):
+                    break
+
+        self.cycles += 1
+        if failed:
+            self.partial_cycles += 1
+        else:
+            self.backoff.success()
+            self.interval = max(self.min_interval, self.interval * 0.9)
+        self.next_poll = time.monotonic() + self.interval
+
+        if prices:
+            writer.write(build_points(prices, self.reverse_mapping, self.schema))
+        self._write_metrics(writer)
+
+    def sleep_time(self) -> float:
+        """Returns the seconds until the next poll is due."""
+        return max(
+            self.backoff.remaining(),
+            self.bucket.wait_time(len(self.chunks)),
+            self.next_poll - time.monotonic(),
+            0.0,
         )
 
-        json_body = [{"measurement": "allcrypto", "fields": data}]
-        client.write_points(json_body)
-        time.sleep(10)  # Sleep to prevent rate limiting, adjust as needed.
+    def _set_mapping(self, mapping: Dict[str, str]) -> None:
+        """Rebuilds the id lookup, chunks and rate limits for a mapping."""
+        self._mapping = mapping
+        self.reverse_mapping = {v: k for k, v in mapping.items()}
+        self.chunks = chunk_ids(list(mapping.values()))
+        self.bucket.capacity = max(1, len(self.chunks))
+        self.min_interval = max(
+            self._min_interval, len(self.chunks) * 60 / self.calls_per_minute
+        )
+        self.max_interval = max(self._max_interval, self.min_interval)
+        self.interval = min(self.max_interval, max(self.min_interval, self.interval))
+
+    def _handle_error(self, error: Exception) -> bool:
+        """Records a failed call. Returns whether to try the remaining chunks."""
+        status = get_status_code(error)
+        if status == 429 or (status is not None and status >= 500):
+            if status == 429:
+                self.rate_limited += 1
+            self.interval = min(self.max_interval, self.interval * 2)
+            delay = self.backoff.failure()
+            print(f"CoinGecko returned {status}, backing off {delay:.0f}s")
+            return False
+        self.errors += 1
+        print(f"CoinGecko request failed: {error!r}")
+        return True
+
+    def _write_metrics(self, writer: BatchWriter) -> None:
+        writer.write(
+            [
+                {
+                    "measurement": "allcrypto_poller",
+                    "fields": {
+                        "interval": self.interval,
+                        "chunks": len(self.chunks),
+                        "cycles": self.cycles,
+                        "skipped_cycles": self.skipped_cycles,
+                        "partial_cycles": self.partial_cycles,
+                        "rate_limited": self.rate_limited,
+                        "errors": self.errors,
+                        "delay": self.delay,
+                    },
+                }
+            ]
+        )
+
+
+def create_poller(cg: CoinGeckoAPI) -> CryptoPoller:
+    """Creates a CryptoPoller configured from the environment.
+
+    Args:
+        cg: A CoinGeckoAPI client instance.
+
+    Returns:
+        A CryptoPoller that follows the cached Kraken to CoinGecko mapping.
+    """
+    return CryptoPoller(
+        cg,
+        create_mapping_cache(cg),
+        schema=get_schema(),
+        calls_per_minute=float(os.getenv("COINGECKO_CALLS_PER_MINUTE", 10)),
+    )
+
+
+def fetch_and_write_crypto_data(writer: BatchWriter, poller: CryptoPoller):
+    """Fetches crypto data and writes it to InfluxDB.
+
+    Args:
+        writer: A BatchWriter instance.
+        poller: A CryptoPoller instance.
+    """
+    while True:
+        poller.poll(writer)
+        time.sleep(poller.sleep_time())
+
+
+def create_mapping_cache(cg: CoinGeckoAPI) -> JsonFileCache:
+    """Builds the cache holding the Kraken to CoinGecko mapping.
+
+    The mapping is cached for ``COINGECKO_CACHE_TTL`` seconds. A stale
+    mapping is used straight away and refreshed in the background; if
+    CoinGecko is unavailable the stale copy keeps being used.
+
+    Rebuilding the mapping always fetches a fresh coin list. The coin list
+    cache is only a fallback: it supplies the last good list when that
+    fetch fails, so the mapping can still be rebuilt, e.g. after its own
+    cache file was lost.
+
+    Args:
+        cg: A CoinGeckoAPI client instance.
+
+    Returns:
+        A JsonFileCache of Kraken symbols to CoinGecko symbols.
+    """
+    ttl = float(os.getenv("COINGECKO_CACHE_TTL", 24 * 60 * 60))
+    coins = JsonFileCache(cache_path("coingecko-coins.json"), ttl, cg.get_coins_list)
+    mapping = JsonFileCache(
+        cache_path("kraken-gecko-mapping.json"),
+        ttl,
+        lambda: get_kraken_gecko_mapping(coins.refresh(), get_kraken_crypto_symbols()),
+    )
+    return mapping
+
+
+def create_mapping(cg: CoinGeckoAPI) -> Dict[str, str]:
+    """Returns the current Kraken to CoinGecko mapping, see
+    ``create_mapping_cache``."""
+    return create_mapping_cache(cg).get()
 
 
 def main():
     """Main function to execute the script logic."""
-    client = get_influxdb_client()
-    cg = CoinGeckoAPI()
-    currencies = cg.get_coins_list()
-    kraken_crypto = get_kraken_crypto_symbols()
-    mapping = get_kraken_gecko_mapping(currencies, kraken_crypto)
-    fetch_and_write_crypto_data(client, cg, mapping)
+    writer = create_writer()
+    poller = create_poller(CoinGeckoAPI())
+    fetch_and_write_crypto_data(writer, poller)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,95 @@
+"""
+Backfills the tagged allcrypto_by_symbol measurement from wide allcrypto history.
+
+Reads ``allcrypto`` rows in time chunks, splits each ``{symbol}.{field}``
+column into one point per symbol and writes them with their original
+timestamps. Re-running over the same range rewrites identical points.
+"""
+
+import argparse
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Tuple
+from influx_writer import create_influxdb_client
+
+SOURCE_MEASUREMENT = "allcrypto"
+TARGET_MEASUREMENT = "allcrypto_by_symbol"
+
+
+def split_row(row: Dict) -> List[Dict]:
+    """
+    Converts one wide allcrypto row into tagged per-symbol points.
+
+    Args:
+        row (Dict): A row from the query, with ``time`` in nanoseconds.
+
+    Returns:
+        List[Dict]: One point per symbol present in the row.
+    """
+    by_symbol: Dict[str, Dict[str, float]] = {}
+    for column, value in row.items():
+        if column == "time" or value is None:
+            continue
+        symbol, _, field = column.partition(".")
+        if field:
+            by_symbol.setdefault(symbol, {})[field] = value
+
+    return [
+        {
+            "measurement": TARGET_MEASUREMENT,
+            "tags": {"symbol": symbol},
+            "time": row["time"],
+            "fields": fields,
+        }
+        for symbol, fields in by_symbol.items()
+    ]
+
+
+def time_chunks(
+    start: datetime, end: datetime, step: timedelta
+) -> Iterator[Tuple[datetime, datetime]]:
+    """Yields consecutive ``[from, to)`` ranges covering ``[start, end)``."""
+    while start < end:
+        yield start, min(start + step, end)
+        start += step
+
+
+def parse_time(value: str) -> datetime:
+    """Parses an ISO 8601 timestamp, assuming UTC when no zone is given."""
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--start", type=parse_time, required=True)
+    parser.add_argument("--end", type=parse_time, default=datetime.now(timezone.utc))
+    parser.add_argument(
+        "--chunk-hours", type=float, default=6, help="hours of history per query"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=20000, help="points per write request"
+    )
+    args = parser.parse_args()
+
+    client = create_influxdb_client()
+
+    total = 0
+    for chunk_start, chunk_end in time_chunks(
+        args.start, args.end, timedelta(hours=args.chunk_hours)
+    ):
+        result = client.query(
+            f'SELECT * FROM "{SOURCE_MEASUREMENT}" '
+            f"WHERE time >= '{chunk_start.isoformat()}' "
+            f"AND time < '{chunk_end.isoformat()}'",
+            epoch="ns",
+        )
+        points = [p for row in result.get_points() for p in split_row(row)]
+        client.write_points(points, batch_size=args.batch_size)
+        total += len(points)
+        print(f"{chunk_start.isoformat()} - {chunk_end.isoformat()}: {len(points)}")
+
+    print(f"Wrote {total} points to {TARGET_MEASUREMENT}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,63 +1,295 @@
 import os
 import time
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 from easysnmp import Session
-from influxdb import InfluxDBClient
+from influx_writer import BatchWriter, create_writer
+from scheduling import FixedRateTicker
 
+# Scheduler health is reported once per this many ticks.
+REPORT_EVERY = 60
 
-def get_bandwidth_statistics(session: Session, if_index: int) -> Dict[str, float]:
+
+# IF-MIB columns. The ifHC* counters are 64 bits wide and do not wrap at
+# gigabit rates the way the 32-bit ifInOctets/ifOutOctets do.
+IF_DESCR = ".1.3.6.1.2.1.2.2.1.2"
+IF_HC_IN_OCTETS = ".1.3.6.1.2.1.31.1.1.1.6"
+IF_HC_OUT_OCTETS = ".1.3.6.1.2.1.31.1.1.1.10"
+
+# Rates above this are treated as a counter reset rather than real traffic.
+DEFAULT_MAX_BPS = 10e9
+
+# Measurement name to interface, as an ifDescr or a numeric ifIndex.
+DEFAULT_INTERFACES = "mtnbb_fiber=2,starlink_bandwidth=3"
+
+
+class CounterRates:
+    """Turns successive octet counter samples into bits-per-second rates."""
+
+    def __init__(self, counter_bits: int = 64, max_bps: float = DEFAULT_MAX_BPS):
+        """
+        Args:
+        counter_bits (int): Width of the SNMP counters, for wrap handling.
+        max_bps (float): Rates above this are treated as a counter reset.
+        """
+        self.modulus = 2**counter_bits
+        self.max_bps = max_bps
+        self.resets = 0
+        self._last: Dict[Tuple[str, str], Tuple[float, int]] = {}
+
+    def update(self, key: Tuple[str, str], value: float, at_ns: int) -> Optional[float]:
+        """
+        Record a counter sample and return the rate since the previous one.
+
+        A counter that went backwards is assumed to have wrapped once. If the
+        rate that implies is implausible, the router was rebooted or the
+        counter was cleared, and no rate is returned for this sample.
+
+        Args:
+        key (Tuple[str, str]): Measurement and field the counter belongs to.
+        value (float): Counter value in octets.
+        at_ns (int): Monotonic time of the sample in nanoseconds.
+
+        Returns:
+        Optional[float]: Bits per second, or None for the first sample and
+        after a reset.
+        """
+        last = self._last.get(key)
+        self._last[key] = (value, at_ns)
+        if last is None:
+            return None
+
+        previous, previous_ns = last
+        elapsed = (at_ns - previous_ns) / 1e9
+        if elapsed <= 0:
+            return None
+
+        delta = value - previous
+        if delta < 0:
+            delta += self.modulus
+        bps = delta * 8 / elapsed
+        if bps > self.max_bps:
+            self.resets += 1
+            return None
+        return bps
+
+
+def create_snmp_session() -> Session:
+    """
+    Create an SNMP session to the pfSense router from environment variables.
+
+    Returns:
+    Session: The SNMP session object.
+    """
+    return Session(
+        hostname=os.getenv("PFSENSE_HOSTNAME"),
+        community=os.getenv("PFSENSE_SNMP_COMMUNITY"),
+        version=2,
+        use_numeric=True,
+    )
+
+
+def parse_interfaces(spec: str) -> Dict[str, str]:
+    """
+    Parse a ``measurement=interface,...`` specification.
+
+    Args:
+    spec (str): e.g. "mtnbb_fiber=igb0,starlink_bandwidth=igb1" or
+        "mtnbb_fiber=2,starlink_bandwidth=3".
+
+    Returns:
+    Dict[str, str]: Measurement name to ifDescr or ifIndex.
+    """
+    interfaces = {}
+    for item in spec.split(","):
+        measurement, _, interface = item.strip().partition("=")
+        interfaces[measurement] = interface
+    return interfaces
+
+
+def discover_interfaces(session: Session, wanted: Dict[str, str]) -> Dict[str, int]:
+    """
+    Resolve interface names to ifIndex values by walking ifDescr once.
+
+    Args:
+    session (Session): The SNMP session object.
+    wanted (Dict[str, str]): Measurement name to ifDescr or ifIndex.
+
+    Returns:
+    Dict[str, int]: Measurement name to ifIndex.
     """
-    Get bandwidth statistics for a given interface index.
+    by_descr: Dict[str, int] = {}
+    if not all(interface.isdigit() for interface in wanted.values()):
+        by_descr = {var.value: int(var.oid_index) for var in session.bulkwalk(IF_DESCR)}
+
+    indexes = {}
+    for measurement, interface in wanted.items():
+        if interface.isdigit():
+            indexes[measurement] = int(interface)
+        elif interface in by_descr:
+            indexes[measurement] = by_descr[interface]
+        else:
+            raise ValueError(f"No interface with ifDescr {interface!r}")
+    return indexes
+
+
+def configured_interfaces(session: Session) -> Dict[str, int]:
+    """
+    Resolve the interfaces named by ``BANDWIDTH_INTERFACES``.
 
     Args:
     session (Session): The SNMP session object.
-    if_index (int): The interface index.
 
     Returns:
-    Dict[str, float]: A dictionary containing inbound and outbound bandwidth.
+    Dict[str, int]: Measurement name to ifIndex.
     """
-    in_oid = f".1.3.6.1.2.1.2.2.1.10.{if_index}"
-    out_oid = f".1.3.6.1.2.1.2.2.1.16.{if_index}"
+    spec = os.getenv("BANDWIDTH_INTERFACES", DEFAULT_INTERFACES)
+    return discover_interfaces(session, parse_interfaces(spec))
+
+
+def create_counter_rates() -> CounterRates:
+    """
+    Create rate state using ``BANDWIDTH_MAX_BPS`` as the plausibility limit.
+
+    Returns:
+    CounterRates: Empty counter state.
+    """
+    return CounterRates(max_bps=float(os.getenv("BANDWIDTH_MAX_BPS", DEFAULT_MAX_BPS)))
+
+
+def get_bandwidth_statistics(
+    session: Session, interfaces: Dict[str, int]
+) -> Dict[str, Dict[str, float]]:
+    """
+    Get octet counters for several interfaces in a single SNMP request.
+
+    Args:
+    session (Session): The SNMP session object.
+    interfaces (Dict[str, int]): Measurement name to ifIndex.
+
+    Returns:
+    Dict[str, Dict[str, float]]: Inbound and outbound octets per measurement.
+    """
+    oids = []
+    for if_index in interfaces.values():
+        oids.append(f"{IF_HC_IN_OCTETS}.{if_index}")
+        oids.append(f"{IF_HC_OUT_OCTETS}.{if_index}")
+    values = session.get(oids)
+
     return {
-        "in": float(session.get(in_oid).value),
-        "out": float(session.get(out_oid).value),
+        measurement: {
+            "in": float(values[2 * i].value),
+            "out": float(values[2 * i + 1].value),
+        }
+        for i, measurement in enumerate(interfaces)
     }
 
 
-def create_influxdb_session() -> InfluxDBClient:
+def get_all_bandwidth_statistics(
+    session: Session, max_interfaces: int = 32
+) -> Dict[int, Dict[str, float]]:
     """
-    Create an InfluxDB client session.
+    Get octet counters for every interface with one GETBULK request.
+
+    Args:
+    session (Session): The SNMP session object.
+    max_interfaces (int): Number of ifXTable rows to request.
 
     Returns:
-    InfluxDBClient: The InfluxDB client session.
-    """
-    return InfluxDBClient(
-        os.getenv("INFLUX_HOSTNAME"),
-        8086,
-        os.getenv("INFLUX_USERNAME"),
-        os.getenv("INFLUX_PASSWORD"),
-        os.getenv("INFLUX_DATABASE"),
-    )
+    Dict[int, Dict[str, float]]: Inbound and outbound octets per ifIndex.
+    """
+    columns = {IF_HC_IN_OCTETS: "in", IF_HC_OUT_OCTETS: "out"}
+    counters: Dict[int, Dict[str, float]] = {}
+    for var in session.get_bulk(list(columns), 0, max_interfaces):
+        field = columns.get("." + var.oid.lstrip("."))
+        if field is not None:
+            counters.setdefault(int(var.oid_index), {})[field] = float(var.value)
+    return counters
 
 
-def main():
-    session = Session(
-        hostname=os.getenv("PFSENSE_HOSTNAME"),
-        community=os.getenv("PFSENSE_SNMP_COMMUNITY"),
-        version=2,
-    )
+def poll_once(
+    session: Session,
+    writer: BatchWriter,
+    interfaces: Dict[str, int],
+    rates: Optional[CounterRates] = None,
+) -> List[Dict]:
+    """
+    Sample the WAN interfaces and enqueue one point per interface.
 
-    client = create_influxdb_session()
+    Each point carries the wall-clock time the sample was taken rather than
+    the time the server happens to receive it. With ``rates``, ``in_bps`` and
+    ``out_bps`` fields are added next to the raw counters.
 
-    while True:
-        json_body: List[Dict] = [
-            {"measurement": "fiber", "fields": get_bandwidth_statistics(session, 2)},
-            {"measurement": "starlink", "fields": get_bandwidth_statistics(session, 3)},
+    Args:
+    session (Session): The SNMP session object.
+    writer (BatchWriter): Shared InfluxDB writer.
+    interfaces (Dict[str, int]): Measurement name to ifIndex.
+    rates (Optional[CounterRates]): Counter state for rate computation.
+
+    Returns:
+    List[Dict]: The points written.
+    """
+    sampled_at = time.time_ns()
+    sampled_mono = time.monotonic_ns()
+    statistics = get_bandwidth_statistics(session, interfaces)
+
+    json_body: List[Dict] = []
+    for measurement, fields in statistics.items():
+        if rates is not None:
+            for direction in ("in", "out"):
+                bps = rates.update(
+                    (measurement, direction), fields[direction], sampled_mono
+                )
+                if bps is not None:
+                    fields[f"{direction}_bps"] = bps
+        json_body.append(
+            {"measurement": measurement, "time": sampled_at, "fields": fields}
+        )
+    writer.write(json_body)
+    return json_body
+
+
+def report_scheduler(
+    writer: BatchWriter, ticker: FixedRateTicker, rates: CounterRates
+) -> None:
+    """
+    Write cumulative tick and counter-reset counts for the polling loop.
+
+    Args:
+    writer (BatchWriter): Shared InfluxDB writer.
+    ticker (FixedRateTicker): The loop's ticker.
+    rates (CounterRates): The loop's counter state.
+    """
+    writer.write(
+        [
+            {
+                "measurement": "bandwidth_scheduler",
+                "fields": {
+                    "ticks": ticker.ticks,
+                    "late_ticks": ticker.late_ticks,
+                    "missed_ticks": ticker.missed_ticks,
+                    "counter_resets": rates.resets,
+                },
+            }
         ]
+    )
+
 
-        client.write_points(json_body)
-        print(json_body)
-        time.sleep(1)
+def main():
+    session = create_snmp_session()
+    interfaces = configured_interfaces(session)
+    writer = create_writer()
+    ticker = FixedRateTicker(1)
+    rates = create_counter_rates()
+
+    while True:
+        tick = ticker.wait()
+        if tick.missed or tick.late:
+            print(
+                f"Tick {tick.number} late by {tick.lateness:.3f}s, missed {tick.missed}"
+            )
+        print(poll_once(session, writer, interfaces, rates))
+        if tick.number % REPORT_EVERY == 0:
+            report_scheduler(writer, ticker, rates)
 
 
 if __name__ == "__main__":
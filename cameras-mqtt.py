@@ -2,6 +2,10 @@
 
 import random
 import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Tuple
 from paho.mqtt import client as mqtt_client
 from pushover import init, Client
 
@@ -14,6 +18,130 @@ port = 1883
 topic = "#"
 client_id = f"python-mqtt-{random.randint(0, 100)}"
 
+AlertKey = Tuple[str, str]
+
+
+class AlertDispatcher:
+    """Sends alerts from a bounded queue on worker threads.
+
+    ``submit`` never blocks, so it is safe to call from the MQTT network
+    loop. Alerts for the same camera and label are coalesced: while one is
+    queued, a newer snapshot replaces its image, and after one is sent,
+    further alerts for that key are suppressed for ``coalesce_window``
+    seconds. When the queue is full the oldest queued alert is dropped.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str, bytes], None],
+        workers: int = 2,
+        max_queue: int = 32,
+        coalesce_window: float = 30.0,
+    ):
+        """
+        Args:
+            send (Callable[[str, bytes], None]): Delivers one message with
+                its image attachment.
+            workers (int): Number of sending threads.
+            max_queue (int): Most alerts waiting to be sent.
+            coalesce_window (float): Seconds after a sent alert during which
+                the same camera and label are not alerted again.
+        """
+        self.send = send
+        self.max_queue = max_queue
+        self.coalesce_window = coalesce_window
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self._queue: Deque[AlertKey] = deque()
+        self._pending: Dict[AlertKey, Tuple[str, bytes]] = {}
+        self._last_sent: Dict[AlertKey, float] = {}
+        self._ready = threading.Condition()
+        self._workers = [
+            threading.Thread(target=self._run, name=f"alerts-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, camera: str, label: str, message: str, image: bytes) -> bool:
+        """
+        Queue an alert without blocking.
+
+        Args:
+            camera (str): Camera that produced the snapshot.
+            label (str): Detected object label.
+            message (str): Alert text.
+            image (bytes): Snapshot to attach.
+
+        Returns:
+            bool: Whether the alert will be sent, possibly merged into one
+            already queued.
+        """
+        key = (camera, label)
+        with self._ready:
+            if key in self._pending:
+                self._pending[key] = (message, image)
+                self.coalesced += 1
+                return True
+            last_sent = self._last_sent.get(key)
+            if (
+                last_sent is not None
+                and time.monotonic() - last_sent < self.coalesce_window
+            ):
+                self.coalesced += 1
+                return False
+            if len(self._queue) >= self.max_queue:
+                del self._pending[self._queue.popleft()]
+                self.dropped += 1
+            self._queue.append(key)
+            self._pending[key] = (message, image)
+            self._ready.notify()
+        return True
+
+    def _run(self) -> None:
+        while True:
+            with self._ready:
+                while not self._queue:
+                    self._ready.wait()
+                key = self._queue.popleft()
+                message, image = self._pending.pop(key)
+                self._last_sent[key] = time.monotonic()
+            try:
+                self.send(message, image)
+            except Exception as e:
+                print(f"Sending alert failed: {e}")
+                with self._ready:
+                    self.failed += 1
+                continue
+            print(message)
+            with self._ready:
+                self.sent += 1
+
+
+def parse_snapshot_topic(topic: str) -> Optional[Tuple[str, str]]:
+    """
+    Extract the camera and label from a Frigate snapshot topic.
+
+    Args:
+        topic (str): Topic such as "frigate/driveway/person/snapshot".
+
+    Returns:
+        Optional[Tuple[str, str]]: (camera, label) for alerting cameras,
+        otherwise None.
+    """
+    if (
+        "snapshot" in topic
+        and "state" not in topic
+        and ("backdeck" in topic or "driveway" in topic)
+    ):
+        cleantopic = topic.replace("frigate", "").replace("snapshot", "")
+        details = cleantopic[1:-1].split("/")
+        return details[0], details[1]
+    return None
+
 
 def connect_mqtt() -> mqtt_client:
     """Connect to MQTT broker and return the client object."""
@@ -30,32 +158,36 @@ def connect_mqtt() -> mqtt_client:
     return client
 
 
-def subscribe(client: mqtt_client) -> None:
+def subscribe(client: mqtt_client, dispatcher: AlertDispatcher) -> None:
     """Subscribe to MQTT topic and handle incoming messages."""
 
     def on_message(client, userdata, msg):
-        """Handle incoming MQTT messages."""
-        if (
-            "snapshot" in msg.topic
-            and "state" not in msg.topic
-            and ("backdeck" in msg.topic or "driveway" in msg.topic)
-        ):
-            cleantopic = msg.topic.replace("frigate", "").replace("snapshot", "")
-            details = cleantopic[1:-1].split("/")
-            message = f"Alert from {details[0]} - Found {details[1]}"
-            Client(os.getenv("PUSHOVER_CLIENT_ID")).send_message(
-                message, attachment=msg.payload
-            )
-            print(message)
+        """Handle incoming MQTT messages by queueing an alert."""
+        details = parse_snapshot_topic(msg.topic)
+        if details is not None:
+            camera, label = details
+            message = f"Alert from {camera} - Found {label}"
+            dispatcher.submit(camera, label, message, msg.payload)
 
     client.subscribe(topic)
     client.on_message = on_message
 
 
+def create_dispatcher() -> AlertDispatcher:
+    """Create the alert dispatcher with one shared Pushover client."""
+    pushover = Client(os.getenv("PUSHOVER_CLIENT_ID"))
+    return AlertDispatcher(
+        lambda message, image: pushover.send_message(message, attachment=image),
+        workers=int(os.getenv("CAMERA_ALERT_WORKERS", 2)),
+        max_queue=int(os.getenv("CAMERA_ALERT_QUEUE", 32)),
+        coalesce_window=float(os.getenv("CAMERA_ALERT_COALESCE", 30)),
+    )
+
+
 def run() -> None:
     """Run the MQTT client."""
     client = connect_mqtt()
-    subscribe(client)
+    subscribe(client, create_dispatcher())
     client.loop_forever()
 
 
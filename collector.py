@@ -0,0 +1,238 @@
+"""
+Runs all pollers as periodic jobs on one asyncio event loop in a single process.
+
+Each job's blocking poll function runs in a bounded thread pool. Jobs start
+with a random jitter, are scheduled against fixed deadlines, and an overrun
+is recorded whenever a run takes longer than its interval. Per-job counters
+are written to the ``collector_jobs`` measurement.
+"""
+
+import argparse
+import asyncio
+import importlib
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List
+from influx_writer import BatchWriter, create_writer
+
+JOB_NAMES = [
+    "bandwidth",
+    "crypto-prices",
+    "shrimpy",
+    "weather",
+    "weather-forecast",
+    "nicehash",
+    "all-crypto",
+]
+
+
+@dataclass
+class Job:
+    """A poll function run every ``interval`` seconds."""
+
+    name: str
+    func: Callable[[], object]
+    interval: float
+    jitter: float = 0.0
+    runs: int = 0
+    failures: int = 0
+    overruns: int = 0
+    skipped: int = 0
+    last_duration: float = 0.0
+
+
+def load_script(name: str):
+    """
+    Import one of the collector scripts, which have hyphenated file names.
+
+    Args:
+        name (str): Script name without the ``.py`` suffix.
+
+    Returns:
+        module: The imported module.
+    """
+    return importlib.import_module(name)
+
+
+def build_jobs(writer: BatchWriter) -> Dict[str, Callable[[], Job]]:
+    """
+    Return factories for every known job, keyed by job name.
+
+    Factories are only called for the jobs that are enabled, so a job's
+    imports and API clients are never created unless it runs.
+
+    Args:
+        writer (BatchWriter): Shared InfluxDB writer passed to every job.
+
+    Returns:
+        Dict[str, Callable[[], Job]]: Job factories.
+    """
+
+    def bandwidth() -> Job:
+        mod = load_script("bandwidth")
+        session = mod.create_snmp_session()
+        interfaces = mod.configured_interfaces(session)
+        rates = mod.create_counter_rates()
+        return Job(
+            "bandwidth",
+            lambda: mod.poll_once(session, writer, interfaces, rates),
+            1,
+        )
+
+    def crypto_prices() -> Job:
+        mod = load_script("crypto-prices")
+        polo = mod.Poloniex()
+        return Job("crypto-prices", lambda: mod.poll_once(polo, writer), 5, 1)
+
+    def shrimpy() -> Job:
+        mod = load_script("shrimpy")
+        key = os.getenv("SHRIMPY_API_KEY")
+        secret = os.getenv("SHRIMPY_API_SECRET")
+        return Job("shrimpy", lambda: mod.poll_once(writer, key, secret), 10, 2)
+
+    def weather() -> Job:
+        mod = load_script("weather-scraper")
+        return Job("weather", lambda: mod.poll_once(writer), 60, 5)
+
+    def weather_forecast() -> Job:
+        mod = load_script("weather-forecast")
+        state = mod.ForecastState()
+        return Job("weather-forecast", lambda: mod.poll_once(writer, state), 600, 30)
+
+    def nicehash() -> Job:
+        mod = load_script("nicehash")
+        private, public = mod.create_apis()
+        return Job("nicehash", lambda: mod.poll_once(private, public, writer), 10, 2)
+
+    def all_crypto() -> Job:
+        mod = load_script("all-crypto")
+        poller = mod.create_poller(mod.CoinGeckoAPI())
+        return Job("all-crypto", lambda: poller.poll(writer), 5, 2)
+
+    return {
+        "bandwidth": bandwidth,
+        "crypto-prices": crypto_prices,
+        "shrimpy": shrimpy,
+        "weather": weather,
+        "weather-forecast": weather_forecast,
+        "nicehash": nicehash,
+        "all-crypto": all_crypto,
+    }
+
+
+async def run_job(job: Job, executor: ThreadPoolExecutor) -> None:
+    """
+    Run a job forever against fixed deadlines.
+
+    A run that finishes past the next deadline counts as an overrun, and any
+    deadlines it covered are skipped rather than run back to back.
+
+    Args:
+        job (Job): The job to run.
+        executor (ThreadPoolExecutor): Pool for the blocking poll function.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + random.uniform(0, job.jitter)
+
+    while True:
+        await asyncio.sleep(max(0.0, deadline - loop.time()))
+
+        started = loop.time()
+        try:
+            await loop.run_in_executor(executor, job.func)
+        except Exception as e:
+            job.failures += 1
+            print(f"{job.name}: {e!r}")
+        job.runs += 1
+        job.last_duration = loop.time() - started
+
+        deadline += job.interval
+        now = loop.time()
+        if now > deadline:
+            missed = int((now - deadline) // job.interval) + 1
+            job.overruns += 1
+            job.skipped += missed
+            deadline += missed * job.interval
+            print(
+                f"{job.name}: run took {job.last_duration:.2f}s, "
+                f"interval is {job.interval}s, skipped {missed}"
+            )
+
+
+async def report_jobs(jobs: List[Job], writer: BatchWriter, interval: float) -> None:
+    """
+    Periodically write per-job counters to InfluxDB.
+
+    Args:
+        jobs (List[Job]): Jobs to report on.
+        writer (BatchWriter): Shared InfluxDB writer.
+        interval (float): Seconds between reports.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        now = time.time_ns()
+        writer.write(
+            [
+                {
+                    "measurement": "collector_jobs",
+                    "tags": {"job": job.name},
+                    "time": now,
+                    "fields": {
+                        "runs": job.runs,
+                        "failures": job.failures,
+                        "overruns": job.overruns,
+                        "skipped": job.skipped,
+                        "last_duration": job.last_duration,
+                    },
+                }
+                for job in jobs
+            ]
+        )
+
+
+async def run(names: List[str], workers: int) -> None:
+    writer = create_writer()
+    factories = build_jobs(writer)
+    jobs = [factories[name]() for name in names]
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+
+    try:
+        await asyncio.gather(
+            report_jobs(jobs, writer, 60),
+            *(run_job(job, executor) for job in jobs),
+        )
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "jobs",
+        nargs="*",
+        help=f"jobs to run, any of {', '.join(JOB_NAMES)} (default: all)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("COLLECTOR_WORKERS", 4)),
+        help="size of the thread pool for blocking poll calls",
+    )
+    args = parser.parse_args()
+    unknown = set(args.jobs) - set(JOB_NAMES)
+    if unknown:
+        parser.error(f"unknown jobs: {', '.join(sorted(unknown))}")
+    names = args.jobs or JOB_NAMES
+
+    try:
+        asyncio.run(run(names, args.workers))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,60 +1,239 @@
+import json
 import os
 import time
-from typing import List, Dict
-from influxdb import InfluxDBClient
+from typing import Callable, Dict, Iterable, List, Optional
+from influx_writer import BatchWriter, create_writer
 from poloniex import Poloniex
+from rate_limit import Backoff
 
+DEFAULT_PAIRS = "USDT_BTC,USDT_ETH,USDT_XMR"
+TICKER_CHANNEL = 1002
+WEBSOCKET_URL = "wss://api2.poloniex.com"
 
-def get_ticker_data(polo: Poloniex, currency_pair: str) -> float:
+
+def get_pairs() -> List[str]:
+    """
+    Return the currency pairs to track from ``CRYPTO_PAIRS``.
+
+    Returns:
+    List[str]: Pairs such as "USDT_BTC".
+    """
+    return [p for p in os.getenv("CRYPTO_PAIRS", DEFAULT_PAIRS).split(",") if p]
+
+
+def extract_prices(ticker: Dict, pairs: Iterable[str]) -> Dict[str, float]:
     """
-    Retrieve the last price of a given currency pair from Poloniex.
+    Pull the last price of several pairs out of one ``returnTicker`` result.
 
     Args:
-    polo (Poloniex): The Poloniex API object.
-    currency_pair (str): The currency pair (e.g., "USDT_BTC").
+    ticker (Dict): Whole-exchange ticker keyed by pair.
+    pairs (Iterable[str]): Pairs to extract; unknown pairs are skipped.
 
     Returns:
-    float: The last price of the currency pair.
+    Dict[str, float]: Pair to last price.
     """
-    ticker = polo.returnTicker()[currency_pair]
-    return round(float(ticker["last"]), 3)
+    prices = {}
+    for pair in pairs:
+        if pair in ticker:
+            prices[pair] = round(float(ticker[pair]["last"]), 3)
+        else:
+            print(f"Pair {pair} is not in the Poloniex ticker")
+    return prices
 
 
-def create_influxdb_client() -> InfluxDBClient:
+def poll_once(
+    polo: Poloniex, writer: BatchWriter, pairs: Optional[List[str]] = None
+) -> List[Dict]:
     """
-    Create an InfluxDB client.
+    Fetch the ticker once and enqueue the tracked prices.
+
+    Args:
+    polo (Poloniex): The Poloniex API object.
+    writer (BatchWriter): Shared InfluxDB writer.
+    pairs (Optional[List[str]]): Pairs to write; defaults to ``get_pairs()``.
 
     Returns:
-    InfluxDBClient: The InfluxDB client object.
-    """
-    return InfluxDBClient(
-        os.getenv("INFLUX_HOSTNAME"),
-        8086,
-        os.getenv("INFLUX_USERNAME"),
-        os.getenv("INFLUX_PASSWORD"),
-        os.getenv("INFLUX_DATABASE"),
+    List[Dict]: The points written.
+    """
+    prices = extract_prices(polo.returnTicker(), pairs or get_pairs())
+    json_body: List[Dict] = (
+        [{"measurement": "cryptocurrency", "fields": prices}] if prices else []
     )
+    writer.write(json_body)
+    return json_body
+
+
+def parse_ticker_message(message: str, pair_ids: Dict[int, str]) -> Dict[str, float]:
+    """
+    Decode one ticker channel message.
+
+    Updates look like ``[1002, null, [pair_id, "last", ...]]``; the
+    subscription acknowledgement and heartbeats carry no update.
+
+    Args:
+    message (str): Raw websocket message.
+    pair_ids (Dict[int, str]): Poloniex pair id to tracked pair name.
+
+    Returns:
+    Dict[str, float]: The updated price, or nothing if not a tracked pair.
+    """
+    decoded = json.loads(message)
+    if len(decoded) < 3 or decoded[0] != TICKER_CHANNEL:
+        return {}
+    update = decoded[2]
+    pair = pair_ids.get(update[0])
+    if pair is None:
+        return {}
+    return {pair: round(float(update[1]), 3)}
+
+
+def websocket_connect():
+    """
+    Open a connection to the Poloniex push API.
+
+    Returns:
+    A connection with ``send``, ``recv`` and ``close``.
+    """
+    from websocket import create_connection
+
+    return create_connection(WEBSOCKET_URL, timeout=30)
+
+
+class StubConnection:
+    """Offline stand-in for the websocket that replays recorded messages."""
+
+    def __init__(self, messages: List[str], delay: float = 0.0):
+        """
+        Args:
+        messages (List[str]): Messages returned by successive ``recv`` calls.
+        delay (float): Seconds to wait before each message.
+        """
+        self.messages = list(messages)
+        self.delay = delay
+        self.sent: List[str] = []
+
+    def send(self, message: str) -> None:
+        self.sent.append(message)
+
+    def recv(self) -> str:
+        if not self.messages:
+            raise ConnectionError("Stub connection exhausted")
+        time.sleep(self.delay)
+        return self.messages.pop(0)
+
+    def close(self) -> None:
+        pass
+
+
+class TickerStream:
+    """Streams ticker updates and writes the latest prices as they change."""
+
+    def __init__(
+        self,
+        connect: Callable,
+        pair_ids: Dict[int, str],
+        writer: BatchWriter,
+        min_interval: float = 0.5,
+    ):
+        """
+        Args:
+        connect (Callable): Returns a connection with ``send``, ``recv`` and
+            ``close``, e.g. ``websocket_connect`` or a ``StubConnection``.
+        pair_ids (Dict[int, str]): Poloniex pair id to tracked pair name.
+        writer (BatchWriter): Shared InfluxDB writer.
+        min_interval (float): Coalesce updates into at most one point per
+            this many seconds.
+        """
+        self.connect = connect
+        self.pair_ids = pair_ids
+        self.writer = writer
+        self.min_interval = min_interval
+        self.prices: Dict[str, float] = {}
+        self._dirty = False
+        self._last_write = 0.0
+
+    def run_connection(self) -> None:
+        """Subscribe and process messages until the connection fails."""
+        connection = self.connect()
+        try:
+            connection.send(
+                json.dumps({"command": "subscribe", "channel": TICKER_CHANNEL})
+            )
+            while True:
+                self.handle(connection.recv())
+        finally:
+            connection.close()
+
+    def handle(self, message: str) -> None:
+        """
+        Apply one message and write a point if the coalescing interval passed.
+
+        Args:
+        message (str): Raw websocket message.
+        """
+        for pair, price in parse_ticker_message(message, self.pair_ids).items():
+            if self.prices.get(pair) != price:
+                self.prices[pair] = price
+                self._dirty = True
+        now = time.monotonic()
+        if self._dirty and now - self._last_write >= self.min_interval:
+            self.writer.write(
+                [{"measurement": "cryptocurrency", "fields": dict(self.prices)}]
+            )
+            self._dirty = False
+            self._last_write = now
+
+    def run(self) -> None:
+        """Stream forever, reconnecting with backoff."""
+        backoff = Backoff(base=1, maximum=60)
+        while True:
+            started = time.monotonic()
+            try:
+                self.run_connection()
+            except Exception as e:
+                if time.monotonic() - started > 60:
+                    backoff.success()
+                delay = backoff.failure()
+                print(f"Poloniex stream failed, reconnecting in {delay:.0f}s: {e}")
+                time.sleep(delay)
+
+
+def get_pair_ids(polo: Poloniex, pairs: Iterable[str]) -> Dict[int, str]:
+    """
+    Map the numeric ids used by the push API to tracked pair names.
+
+    Args:
+    polo (Poloniex): The Poloniex API object.
+    pairs (Iterable[str]): Tracked pairs.
+
+    Returns:
+    Dict[int, str]: Pair id to pair name.
+    """
+    ticker = polo.returnTicker()
+    return {int(ticker[pair]["id"]): pair for pair in pairs if pair in ticker}
 
 
 def main():
     polo = Poloniex()
-    client = create_influxdb_client()
-
-    while True:
-        json_body: List[Dict] = [
-            {
-                "measurement": "cryptocurrency",
-                "fields": {
-                    "USDT_BTC": get_ticker_data(polo, "USDT_BTC"),
-                    "USDT_ETH": get_ticker_data(polo, "USDT_ETH"),
-                    "USDT_XMR": get_ticker_data(polo, "USDT_XMR"),
-                },
-            }
-        ]
-
-        print(json_body)
-        client.write_points(json_body)
-        time.sleep(5)
+    writer = create_writer()
+    pairs = get_pairs()
+
+    if os.getenv("CRYPTO_PRICES_STREAM", "0") != "1":
+        while True:
+            print(poll_once(polo, writer, pairs))
+            time.sleep(5)
+
+    stream = TickerStream(
+        websocket_connect,
+        get_pair_ids(polo, pairs),
+        writer,
+        float(os.getenv("CRYPTO_PRICES_MIN_INTERVAL", 0.5)),
+    )
+    # Seed with a polled snapshot; the stream only sends changes.
+    snapshot = poll_once(polo, writer, pairs)
+    if snapshot:
+        stream.prices.update(snapshot[0]["fields"])
+    stream.run()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,142 @@
+"""
+Change-only (deadband) filtering stage for the batch writer.
+
+A point of a filtered measurement is only written when one of its fields
+moved past that field's threshold since the last written point of the same
+series, or when the series has been silent for ``max_silence`` seconds. The
+heartbeat keeps "previous" fills and last-value panels accurate.
+
+Rules are configured as comma-separated ``measurement[.field][=threshold]``
+entries, where the threshold is an absolute change such as ``0.5`` or a
+relative one such as ``0.1%``. Without a threshold any change is written.
+"""
+
+import threading
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_MAX_SILENCE = 3600
+
+# (absolute, relative) change that counts as meaningful
+Threshold = Tuple[float, float]
+SeriesKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def parse_threshold(value: str) -> Threshold:
+    """
+    Parse ``"0.5"`` as an absolute and ``"0.1%"`` as a relative threshold.
+
+    Args:
+        value (str): Threshold text; empty means any change.
+
+    Returns:
+        Threshold: (absolute, relative) threshold.
+    """
+    if not value:
+        return (0.0, 0.0)
+    if value.endswith("%"):
+        return (0.0, float(value[:-1]) / 100)
+    return (float(value), 0.0)
+
+
+def parse_rules(spec: str) -> Dict[str, Dict[Optional[str], Threshold]]:
+    """
+    Parse a rule specification such as ``"nicehash=0.1%,shrimpy.total_usd=1"``.
+
+    Args:
+        spec (str): Comma-separated ``measurement[.field][=threshold]`` entries.
+
+    Returns:
+        Dict[str, Dict[Optional[str], Threshold]]: Measurement to field
+        thresholds, where the None field is the measurement default.
+    """
+    rules: Dict[str, Dict[Optional[str], Threshold]] = {}
+    for entry in filter(None, (e.strip() for e in spec.split(","))):
+        target, _, threshold = entry.partition("=")
+        measurement, _, field = target.partition(".")
+        rules.setdefault(measurement, {})[field or None] = parse_threshold(threshold)
+    return rules
+
+
+def _changed(old, new, threshold: Threshold) -> bool:
+    if isinstance(new, bool) or not isinstance(new, (int, float)):
+        return old != new
+    if isinstance(old, bool) or not isinstance(old, (int, float)):
+        return True
+    absolute, relative = threshold
+    return abs(new - old) > max(absolute, relative * abs(old))
+
+
+class DeadbandFilter:
+    """Writer stage that drops points which did not change meaningfully."""
+
+    def __init__(
+        self,
+        rules: Dict[str, Dict[Optional[str], Threshold]],
+        max_silence: float = DEFAULT_MAX_SILENCE,
+    ):
+        """
+        Args:
+            rules (Dict[str, Dict[Optional[str], Threshold]]): Thresholds per
+                measurement and field, as returned by ``parse_rules``. Other
+                measurements pass through untouched.
+            max_silence (float): Write a series at least this often, in
+                seconds, even if nothing changed.
+        """
+        self.rules = rules
+        self.max_silence = int(max_silence * 1_000_000_000)
+        self.suppressed = 0
+        self._last: Dict[SeriesKey, Tuple[int, Dict]] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, points: List[Dict]) -> List[Dict]:
+        """
+        Filter points against the last written point of their series.
+
+        A written point keeps all of its fields, so dashboards never see a
+        partial point.
+
+        Args:
+            points (List[Dict]): Timestamped points headed for the writer.
+
+        Returns:
+            List[Dict]: The points worth writing.
+        """
+        kept = []
+        with self._lock:
+            for point in points:
+                rules = self.rules.get(point["measurement"])
+                if rules is None:
+                    kept.append(point)
+                    continue
+                key = (
+                    point["measurement"],
+                    tuple(sorted((point.get("tags") or {}).items())),
+                )
+                fields = point["fields"]
+                last = self._last.get(key)
+                if last is not None and not self._should_write(
+                    last, point["time"], fields, rules
+                ):
+                    self.suppressed += 1
+                    continue
+                self._last[key] = (point["time"], dict(fields))
+                kept.append(point)
+        return kept
+
+    def _should_write(
+        self,
+        last: Tuple[int, Dict],
+        at: int,
+        fields: Dict,
+        rules: Dict[Optional[str], Threshold],
+    ) -> bool:
+        written_at, written = last
+        if at - written_at >= self.max_silence:
+            return True
+        default = rules.get(None, (0.0, 0.0))
+        for name, value in fields.items():
+            if name not in written:
+                return True
+            if _changed(written[name], value, rules.get(name, default)):
+                return True
+        return False
@@ -0,0 +1,113 @@
+"""
+On-disk JSON cache with a TTL, background refresh and stale fallback.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Optional
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "home-automation")
+
+
+def cache_path(name: str) -> str:
+    """
+    Return the path of a cache file inside ``CACHE_DIR``.
+
+    Args:
+        name (str): File name of the cache entry.
+
+    Returns:
+        str: Absolute path of the cache file.
+    """
+    return os.path.join(os.getenv("CACHE_DIR", DEFAULT_CACHE_DIR), name)
+
+
+class JsonFileCache:
+    """A single JSON value cached in a file and reloaded when it expires."""
+
+    def __init__(self, path: str, ttl: float, loader: Callable[[], Any]):
+        """
+        Args:
+            path (str): File holding the cached value.
+            ttl (float): Seconds before the value is refreshed.
+            loader (Callable[[], Any]): Fetches a fresh, JSON-serialisable value.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.loader = loader
+        self._data: Any = None
+        self._fetched_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+        self._read_file()
+
+    def get(self) -> Any:
+        """
+        Return the cached value without waiting on the loader if possible.
+
+        A stale value is returned immediately while a background thread
+        refreshes it. Only an empty cache blocks on the loader.
+
+        Returns:
+            Any: The cached value.
+        """
+        with self._lock:
+            data, fetched_at = self._data, self._fetched_at
+        if fetched_at is None:
+            return self.refresh()
+        if time.time() - fetched_at > self.ttl and self._refreshing.acquire(False):
+            threading.Thread(
+                target=self._refresh_in_background,
+                name=f"refresh-{os.path.basename(self.path)}",
+                daemon=True,
+            ).start()
+        return data
+
+    def refresh(self) -> Any:
+        """
+        Fetch a fresh value and store it, falling back to stale data on error.
+
+        Returns:
+            Any: The fresh value, or the stale one if the loader failed.
+        """
+        with self._refreshing:
+            return self._refresh_locked()
+
+    def _refresh_in_background(self) -> None:
+        try:
+            self._refresh_locked()
+        finally:
+            self._refreshing.release()
+
+    def _refresh_locked(self) -> Any:
+        try:
+            data = self.loader()
+        except Exception as e:
+            with self._lock:
+                if self._fetched_at is None:
+                    raise
+                print(f"Refreshing {self.path} failed, using stale data: {e}")
+                return self._data
+
+        fetched_at = time.time()
+        self._write_file(data, fetched_at)
+        with self._lock:
+            self._data, self._fetched_at = data, fetched_at
+        return data
+
+    def _read_file(self) -> None:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                entry = json.load(f)
+            self._data, self._fetched_at = entry["data"], entry["fetched_at"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _write_file(self, data: Any, fetched_at: float) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"fetched_at": fetched_at, "data": data}, f)
+        os.replace(tmp, self.path)
@@ -0,0 +1,215 @@
+"""
+Shared buffered InfluxDB writer used by all collectors.
+
+Collectors enqueue points and return immediately; a background thread flushes
+the buffer as gzipped line-protocol batches when it grows past ``batch_size``
+or when ``flush_interval`` seconds have passed since the last flush.
+
+If ``INFLUX_SPOOL_DIR`` is set, batches are appended to an on-disk spool first
+and a replayer drains it to InfluxDB, so an outage only delays delivery.
+
+Point times are integer nanoseconds since the epoch. Stages are callables
+that take a list of points and return the list to enqueue; they run in order
+on the caller's thread and can add, drop or rewrite points.
+"""
+
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+from influxdb import InfluxDBClient
+from influxdb.line_protocol import make_lines
+from deadband import DEFAULT_MAX_SILENCE, DeadbandFilter, parse_rules
+from rollup import DEFAULT_GRACE, RollupAggregator
+from spool import Replayer, Spool
+
+Stage = Callable[[List[Dict]], List[Dict]]
+
+DEFAULT_ROLLUP_MEASUREMENTS = (
+    "mtnbb_fiber,starlink_bandwidth,allcrypto,allcrypto_by_symbol,cistern_level"
+)
+DEFAULT_DEADBAND_RULES = "cryptocurrency,crypto_balance,nicehash,weather_forecast"
+
+
+def create_influxdb_client() -> InfluxDBClient:
+    """
+    Create an InfluxDB client from environment variables.
+
+    Returns:
+        InfluxDBClient: Client with gzip request compression enabled.
+    """
+    return InfluxDBClient(
+        host=os.getenv("INFLUX_HOSTNAME"),
+        port=8086,
+        username=os.getenv("INFLUX_USERNAME"),
+        password=os.getenv("INFLUX_PASSWORD"),
+        database=os.getenv("INFLUX_DATABASE"),
+        gzip=True,
+    )
+
+
+class BatchWriter:
+    """Buffers points in memory and writes them to InfluxDB in batches."""
+
+    def __init__(
+        self,
+        client: InfluxDBClient,
+        batch_size: int = 5000,
+        flush_interval: float = 5.0,
+        max_buffer: int = 100000,
+        spool: Optional[Spool] = None,
+        stages: Optional[List[Stage]] = None,
+    ):
+        """
+        Args:
+            client (InfluxDBClient): Client used to send batches.
+            batch_size (int): Flush as soon as this many points are buffered.
+            flush_interval (float): Flush at least this often, in seconds.
+            max_buffer (int): Oldest points are dropped beyond this many.
+            spool (Optional[Spool]): Write batches to this spool instead of
+                sending them directly.
+            stages (Optional[List[Stage]]): Processing applied to points
+                before they are buffered.
+        """
+        self.client = client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.dropped = 0
+        self.spool = spool
+        self.stages = stages or []
+        self.replayer = Replayer(client, spool) if spool else None
+
+        self._buffer: List[Dict] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="influx-writer", daemon=True
+        )
+        self._thread.start()
+
+    def write(self, points: List[Dict]) -> None:
+        """
+        Enqueue points for writing. Never blocks on the database.
+
+        Points without a ``time`` are stamped with the current time so that
+        delayed delivery does not shift them.
+
+        Args:
+            points (List[Dict]): Points in the ``write_points`` JSON format.
+        """
+        now = time.time_ns()
+        for point in points:
+            point.setdefault("time", now)
+        for stage in self.stages:
+            points = stage(points)
+        with self._lock:
+            self._buffer.extend(points)
+            overflow = len(self._buffer) - self.max_buffer
+            if overflow > 0:
+                del self._buffer[:overflow]
+                self.dropped += overflow
+            if len(self._buffer) >= self.batch_size:
+                self._wakeup.set()
+
+    def flush(self) -> None:
+        """
+        Send everything currently buffered.
+
+        If a batch fails, it and every batch after it are put back at the
+        front of the buffer, ahead of points written in the meantime, and
+        the error is re-raised. The ``max_buffer`` limit still applies.
+        """
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        for start in range(0, len(batch), self.batch_size):
+            try:
+                self._send(batch[start : start + self.batch_size])
+            except Exception:
+                self._requeue(batch[start:])
+                raise
+
+    def _requeue(self, points: List[Dict]) -> None:
+        with self._lock:
+            self._buffer[:0] = points
+            overflow = len(self._buffer) - self.max_buffer
+            if overflow > 0:
+                del self._buffer[:overflow]
+                self.dropped += overflow
+
+    def close(self) -> None:
+        """Stop the flush thread and send any remaining points."""
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+        if self.spool:
+            self.spool.close()
+        if self.replayer:
+            self.replayer.stop()
+
+    def __enter__(self) -> "BatchWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _send(self, points: List[Dict]) -> None:
+        if not points:
+            return
+        lines = make_lines({"points": points})
+        if self.spool:
+            self.spool.append(lines)
+        else:
+            self.client.write_points([lines], protocol="line")
+
+    def _run(self) -> None:
+        last_flush = time.monotonic()
+        while not self._stopping.is_set():
+            timeout = max(0.0, last_flush + self.flush_interval - time.monotonic())
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+            if self._stopping.is_set():
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"InfluxDB flush failed: {e}")
+            last_flush = time.monotonic()
+
+
+def create_writer(client: Optional[InfluxDBClient] = None, **kwargs) -> BatchWriter:
+    """
+    Create a BatchWriter, building the client from the environment if needed.
+
+    Measurements listed in ``INFLUX_ROLLUP_MEASUREMENTS`` also get 1 minute
+    and 1 hour rollups; set it to an empty string to disable them.
+
+    ``INFLUX_DEADBAND`` lists change-only rules (see ``deadband``) and
+    ``INFLUX_DEADBAND_MAX_SILENCE`` the heartbeat in seconds. Deadband runs
+    after the rollups so they still see every raw sample.
+
+    Returns:
+        BatchWriter: A started writer, spooling to ``INFLUX_SPOOL_DIR`` if set.
+    """
+    spool_dir = os.getenv("INFLUX_SPOOL_DIR")
+    if spool_dir and "spool" not in kwargs:
+        kwargs["spool"] = Spool(
+            spool_dir,
+            max_bytes=int(os.getenv("INFLUX_SPOOL_MAX_BYTES", 512 * 1024 * 1024)),
+        )
+    if "stages" not in kwargs:
+        stages: List[Stage] = []
+        rollups = os.getenv("INFLUX_ROLLUP_MEASUREMENTS", DEFAULT_ROLLUP_MEASUREMENTS)
+        if rollups:
+            grace = float(os.getenv("INFLUX_ROLLUP_GRACE", DEFAULT_GRACE))
+            stages.append(RollupAggregator(rollups.split(","), grace=grace))
+        deadband = parse_rules(os.getenv("INFLUX_DEADBAND", DEFAULT_DEADBAND_RULES))
+        if deadband:
+            max_silence = float(
+                os.getenv("INFLUX_DEADBAND_MAX_SILENCE", DEFAULT_MAX_SILENCE)
+            )
+            stages.append(DeadbandFilter(deadband, max_silence))
+        kwargs["stages"] = stages
+    return BatchWriter(client or create_influxdb_client(), **kwargs)
@@ -0,0 +1,241 @@
+"""
+Backfills NiceHash exchange candlesticks into InfluxDB.
+
+The requested range is split into chunks that are fetched concurrently,
+paced by a token bucket. Candles already stored are skipped, new ones are
+written in large batches, and finished chunks are recorded in a checkpoint
+file so an interrupted run resumes where it stopped.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Set, Tuple
+from file_cache import cache_path
+from influx_writer import create_influxdb_client
+from nicehash import HOST
+from nicehash_async import AsyncPublicApi
+from rate_limit import TokenBucket
+
+MEASUREMENT = "nicehash_candles"
+
+
+class Checkpoint:
+    """Set of finished chunk start times persisted as JSON."""
+
+    def __init__(self, path: str):
+        self.path = path
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.done: Set[int] = set(json.load(f))
+        except (OSError, ValueError):
+            self.done = set()
+
+    def mark(self, chunks: List[int]) -> None:
+        self.done.update(chunks)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(sorted(self.done), f)
+        os.replace(tmp, self.path)
+
+
+def candle_points(market: str, resolution: int, candles: List[Dict]) -> List[Dict]:
+    """
+    Converts candlestick responses into timestamped points.
+
+    Args:
+        market (str): Exchange market, e.g. "BTCUSDT".
+        resolution (int): Candle length in minutes.
+        candles (List[Dict]): Candles with ``time`` in seconds.
+
+    Returns:
+        List[Dict]: One point per candle.
+    """
+    tags = {"market": market, "resolution": str(resolution)}
+    return [
+        {
+            "measurement": MEASUREMENT,
+            "tags": tags,
+            "time": int(candle["time"]) * 1_000_000_000,
+            "fields": {
+                k: float(v)
+                for k, v in candle.items()
+                if k != "time" and isinstance(v, (int, float))
+            },
+        }
+        for candle in candles
+    ]
+
+
+def existing_times(
+    client, market: str, resolution: int, start: int, end: int
+) -> Set[int]:
+    """
+    Returns the candle times, in seconds, already stored in ``[start, end)``.
+    """
+    result = client.query(
+        f'SELECT "close" FROM "{MEASUREMENT}" '
+        f"WHERE \"market\" = '{market}' AND \"resolution\" = '{resolution}' "
+        f"AND time >= {start}s AND time < {end}s",
+        epoch="s",
+    )
+    return {row["time"] for row in result.get_points()}
+
+
+class Backfill:
+    """Fetches, de-duplicates and writes one market's candle history."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.market = args.market
+        self.resolution = args.resolution
+        self.chunk_seconds = args.chunk_candles * args.resolution * 60
+        self.batch_size = args.batch_size
+        self.concurrency = args.concurrency
+        self.bucket = TokenBucket(args.requests_per_second, args.concurrency)
+        self.client = create_influxdb_client()
+        self.checkpoint = Checkpoint(
+            args.checkpoint
+            or cache_path(f"nicehash-backfill-{self.market}-{self.resolution}.json")
+        )
+        self.chunks = [
+            start
+            for start in range(args.start, args.end, self.chunk_seconds)
+            if start not in self.checkpoint.done
+        ]
+        self.end = args.end
+        self.written = 0
+        self.skipped = 0
+
+    async def run(self) -> None:
+        """
+        Fetches and writes every remaining chunk.
+
+        The fetchers and the writer are supervised together: if either
+        side fails, the other is cancelled and the error is re-raised, so
+        a failed write cannot leave fetchers blocked on the full queue.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        todo: asyncio.Queue = asyncio.Queue()
+        for start in self.chunks:
+            todo.put_nowait(start)
+
+        async with AsyncPublicApi(HOST, pool_size=self.concurrency) as api:
+            fetchers = [
+                asyncio.create_task(self._fetch(api, todo, queue))
+                for _ in range(self.concurrency)
+            ]
+
+            async def produce() -> None:
+                await asyncio.gather(*fetchers)
+                await queue.put(None)
+
+            producer = asyncio.create_task(produce())
+            writer = asyncio.create_task(self._write(queue))
+            tasks = [*fetchers, producer, writer]
+            try:
+                done, _ = await asyncio.wait(
+                    {producer, writer}, return_when=asyncio.FIRST_EXCEPTION
+                )
+                for task in done:
+                    task.result()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _fetch(self, api, todo: asyncio.Queue, queue: asyncio.Queue) -> None:
+        while not todo.empty():
+            start = todo.get_nowait()
+            end = min(start + self.chunk_seconds, self.end)
+            stored = await asyncio.to_thread(
+                existing_times,
+                self.client,
+                self.market,
+                self.resolution,
+                start,
+                end,
+            )
+            if len(stored) >= (end - start) // (self.resolution * 60):
+                self.skipped += len(stored)
+                await queue.put((start, []))
+                continue
+
+            while not self.bucket.try_acquire():
+                await asyncio.sleep(self.bucket.wait_time())
+            try:
+                candles = await api.get_candlesticks(
+                    self.market, start, end - 1, self.resolution
+                )
+            except Exception as e:
+                print(f"Chunk {start} failed, will retry on the next run: {e}")
+                continue
+
+            fresh = [c for c in candles if int(c["time"]) not in stored]
+            self.skipped += len(candles) - len(fresh)
+            await queue.put((start, candle_points(self.market, self.resolution, fresh)))
+
+    async def _write(self, queue: asyncio.Queue) -> None:
+        pending: List[Dict] = []
+        finished: List[int] = []
+        while True:
+            item: Tuple[int, List[Dict]] = await queue.get()
+            if item is not None:
+                start, points = item
+                pending += points
+                finished.append(start)
+            if pending and (item is None or len(pending) >= self.batch_size):
+                await asyncio.to_thread(
+                    self.client.write_points, pending, batch_size=self.batch_size
+                )
+                self.written += len(pending)
+                pending = []
+            # Every finished chunk's points have been written once nothing is
+            # pending; a failed write raises above and marks nothing.
+            if finished and (item is None or not pending):
+                self.checkpoint.mark(finished)
+                finished = []
+            if item is None:
+                return
+
+
+def parse_time(value: str) -> int:
+    """Parses an ISO 8601 timestamp (UTC if no zone) into epoch seconds."""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("market", help="exchange market, e.g. BTCUSDT")
+    parser.add_argument("--start", type=parse_time, required=True)
+    parser.add_argument("--end", type=parse_time, default=int(time.time()))
+    parser.add_argument(
+        "--resolution", type=int, default=60, help="candle length in minutes"
+    )
+    parser.add_argument(
+        "--chunk-candles", type=int, default=500, help="candles per API request"
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests-per-second", type=float, default=5)
+    parser.add_argument("--batch-size", type=int, default=20000)
+    parser.add_argument("--checkpoint", help="checkpoint file path")
+    args = parser.parse_args()
+
+    backfill = Backfill(args)
+    started = time.monotonic()
+    asyncio.run(backfill.run())
+    elapsed = time.monotonic() - started
+    print(
+        f"Wrote {backfill.written} candles, skipped {backfill.skipped} already "
+        f"stored, in {elapsed:.1f}s ({backfill.written / max(elapsed, 1e-9):.0f}/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,62 @@
 """ Gets current NiceHash mining statistics, writes to InfluxDB.  Not yet mypy-compliant. """
 
 import pprint
-from influxdb import InfluxDBClient
-from datetime import datetime
-from time import mktime, sleep
+from time import monotonic, sleep, time_ns
+from concurrent.futures import ThreadPoolExecutor
 import uuid
 import hmac
 import requests
 import json
 from hashlib import sha256
 import os
-
-client = InfluxDBClient(
-    os.getenv("INFLUX_HOSTNAME"),
-    8086,
-    os.getenv("INFLUX_USERNAME"),
-    os.getenv("INFLUX_PASSWORD"),
-    os.getenv("INFLUX_DATABASE"),
-)
+import numpy as np
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from influx_writer import create_writer
+
+HOST = "https://api2.nicehash.com"
+MINING_ADDRESS = "3M6uRT9JF7VeSKQqtwzSUJZfgVWGW4xvw2"
+
+# Upper bound on one poll cycle; the three calls in it run concurrently.
+CYCLE_TIMEOUT = 8
+# Retries within a cycle. A single retry is made without backoff, so each
+# request's worst case is set by its timeouts alone; see request_timeout.
+REQUEST_RETRIES = 1
+
+
+def request_timeout(cycle_timeout=CYCLE_TIMEOUT, retries=REQUEST_RETRIES):
+    """Returns the requests timeout that keeps every attempt of a request,
+    connect and read each taking up to the timeout, within one cycle."""
+    return cycle_timeout / (2 * (retries + 1))
+
+
+def create_session(pool_size=10, retries=REQUEST_RETRIES, backoff_factor=0.5):
+    """Returns a keep-alive session with a connection pool and retries on
+    idempotent requests, to be shared by all API clients. Retry-After is
+    not honoured, as waiting it out would overrun the cycle; the next cycle
+    retries instead."""
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        respect_retry_after_header=False,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
 
 class public_api:
-    def __init__(self, host, verbose=False):
+    def __init__(self, host, verbose=False, session=None, timeout=10):
         self.host = host
         self.verbose = verbose
+        self.session = session or create_session()
+        self.timeout = timeout
 
     def request(self, method, path, query, body):
         url = self.host + path
@@ -33,12 +66,13 @@ class public_api:
         if self.verbose:
             print(method, url)
 
-        s = requests.Session()
         if body:
             body_json = json.dumps(body)
-            response = s.request(method, url, data=body_json)
+            response = self.session.request(
+                method, url, data=body_json, timeout=self.timeout
+            )
         else:
-            response = s.request(method, url)
+            response = self.session.request(method, url, timeout=self.timeout)
 
         if response.status_code == 200:
             return response.json()
@@ -100,6 +134,14 @@ class public_api:
             None,
         )
 
+    def get_exchange_prices(self):
+        return self.request("GET", "/exchange/api/v2/info/prices", "", None)
+
+    def get_mining_rigs(self, address):
+        return self.request(
+            "GET", "/main/api/v2/mining/external/" + address + "/rigs2", "", None
+        )
+
     def get_exchange_orderbook(self, market, limit):
         return self.request(
             "GET",
@@ -110,52 +152,66 @@ class public_api:
 
 
 class private_api:
-    def __init__(self, host, organisation_id, key, secret, verbose=False):
+    def __init__(
+        self,
+        host,
+        organisation_id,
+        key,
+        secret,
+        verbose=False,
+        session=None,
+        timeout=10,
+    ):
         self.key = key
         self.secret = secret
         self.organisation_id = organisation_id
         self.host = host
         self.verbose = verbose
-
-    def request(self, method, path, query, body):
-        xtime = self.get_epoch_ms_from_now()
+        self.session = session or create_session()
+        self.timeout = timeout
+        self._signing_prefix = None
+
+    def signed_headers(self, method, path, query, body_json):
+        """Returns the authentication headers for one request. The key and
+        organisation parts of the signed message never change, so they are
+        built once and the message is assembled with a single join."""
+        if self._signing_prefix is None:
+            self._signing_prefix = self.key + "\x00"
+            self._signing_org = "\x00\x00" + self.organisation_id + "\x00\x00"
+            self._hmac = hmac.new(self.secret.encode("utf-8"), digestmod=sha256)
+
+        xtime = str(self.get_epoch_ms_from_now())
         xnonce = str(uuid.uuid4())
+        parts = [
+            self._signing_prefix,
+            xtime,
+            "\x00",
+            xnonce,
+            self._signing_org,
+            method,
+            "\x00",
+            path,
+            "\x00",
+            query,
+        ]
+        if body_json is not None:
+            parts += ["\x00", body_json]
 
-        message = bytearray(self.key, "utf-8")
-        message += bytearray("\x00", "utf-8")
-        message += bytearray(str(xtime), "utf-8")
-        message += bytearray("\x00", "utf-8")
-        message += bytearray(xnonce, "utf-8")
-        message += bytearray("\x00", "utf-8")
-        message += bytearray("\x00", "utf-8")
-        message += bytearray(self.organisation_id, "utf-8")
-        message += bytearray("\x00", "utf-8")
-        message += bytearray("\x00", "utf-8")
-        message += bytearray(method, "utf-8")
-        message += bytearray("\x00", "utf-8")
-        message += bytearray(path, "utf-8")
-        message += bytearray("\x00", "utf-8")
-        message += bytearray(query, "utf-8")
-
-        if body:
-            body_json = json.dumps(body)
-            message += bytearray("\x00", "utf-8")
-            message += bytearray(body_json, "utf-8")
-
-        digest = hmac.new(bytearray(self.secret, "utf-8"), message, sha256).hexdigest()
-        xauth = self.key + ":" + digest
+        mac = self._hmac.copy()
+        mac.update("".join(parts).encode("utf-8"))
 
-        headers = {
-            "X-Time": str(xtime),
+        return {
+            "X-Time": xtime,
             "X-Nonce": xnonce,
-            "X-Auth": xauth,
+            "X-Auth": self.key + ":" + mac.hexdigest(),
             "Content-Type": "application/json",
             "X-Organization-Id": self.organisation_id,
             "X-Request-Id": str(uuid.uuid4()),
         }
 
-        s = requests.Session()
-        s.headers = headers
+    def request(self, method, path, query, body):
+        body_json = json.dumps(body) if body else None
+        headers = self.signed_headers(method, path, query, body_json)
 
         url = self.host + path
         if query:
@@ -165,9 +221,13 @@ class private_api:
             print(method, url)
 
         if body:
-            response = s.request(method, url, data=body_json)
+            response = self.session.request(
+                method, url, headers=headers, data=body_json, timeout=self.timeout
+            )
         else:
-            response = s.request(method, url)
+            response = self.session.request(
+                method, url, headers=headers, timeout=self.timeout
+            )
 
         if response.status_code == 200:
             return response.json()
@@ -183,9 +243,7 @@ class private_api:
             raise Exception(str(response.status_code) + ": " + response.reason)
 
     def get_epoch_ms_from_now(self):
-        now = datetime.now()
-        now_ec_since_epoch = mktime(now.timetuple()) + now.microsecond / 1000000.0
-        return int(now_ec_since_epoch * 1000)
+        return time_ns() // 1_000_000
 
     def algo_settings_from_response(self, algorithm, algo_response):
         algo_setting = None
@@ -368,42 +426,183 @@ class private_api:
         return self.request("DELETE", "/exchange/api/v2/order", query, None)
 
 
-if __name__ == "__main__":
+def device_arrays(rigs):
+    """Flattens the rigs2 ``miningRigs`` list into per-device points and
+    column arrays for the fleet aggregates. NiceHash packs the VRAM
+    temperature into the upper 16 bits of ``temperature``, and reports -1
+    for unknown power and temperature."""
+    points = []
+    algorithms, hashrates, temperatures, powers, loads = [], [], [], [], []
+    for rig in rigs:
+        rig_tags = {"rig": rig["rigId"], "rig_name": rig.get("name", "")}
+        for device in rig.get("devices", []):
+            speeds = device.get("speeds") or [{}]
+            hashrate = sum(float(s.get("speed", 0)) for s in speeds)
+            algorithm = speeds[0].get("algorithm", "")
+            temperature = device.get("temperature", -1)
+            if temperature > 0:
+                temperature %= 65536
+            power = float(device.get("powerUsage", -1))
+            load = float(device.get("load", 0))
+
+            algorithms.append(algorithm)
+            hashrates.append(hashrate)
+            temperatures.append(temperature)
+            powers.append(power)
+            loads.append(load)
+            points.append(
+                {
+                    "measurement": "nicehash_devices",
+                    "tags": {
+                        **rig_tags,
+                        "device": device["id"],
+                        "device_name": device.get("name", ""),
+                        "algorithm": algorithm,
+                    },
+                    "fields": {
+                        "hashrate": hashrate,
+                        "temperature": float(temperature),
+                        "power": power,
+                        "load": load,
+                    },
+                }
+            )
+    columns = {
+        "algorithm": np.array(algorithms, dtype=str),
+        "hashrate": np.array(hashrates, dtype=float),
+        "temperature": np.array(temperatures, dtype=float),
+        "power": np.array(powers, dtype=float),
+        "load": np.array(loads, dtype=float),
+    }
+    return points, columns
+
+
+def fleet_aggregates(columns):
+    """Returns fleet-wide fields and per-algorithm hashrate totals, computed
+    over the device columns without a Python loop per device."""
+    hashrate = columns["hashrate"]
+    temperature = columns["temperature"]
+    power = columns["power"]
+    mining = hashrate > 0
+    known_temperature = temperature >= 0
+    known_power = power >= 0
+
+    fields = {
+        "devices": int(hashrate.size),
+        "mining_devices": int(np.count_nonzero(mining)),
+        "power": float(power[known_power].sum()),
+        "mean_load": float(columns["load"].mean()) if hashrate.size else 0.0,
+    }
+    if known_temperature.any():
+        fields["max_temperature"] = float(temperature[known_temperature].max())
+        fields["mean_temperature"] = float(temperature[known_temperature].mean())
+
+    names, index = np.unique(columns["algorithm"], return_inverse=True)
+    totals = np.bincount(index, weights=hashrate, minlength=names.size)
+    # Idle devices report no speeds and so have no algorithm.
+    return fields, {n: t for n, t in zip(names.tolist(), totals.tolist()) if n}
+
+
+def rig_points(raw, at):
+    """Returns per-rig, per-device and fleet points for a rigs2 response."""
+    rigs = raw.get("miningRigs", [])
+    points, columns = device_arrays(rigs)
+    for rig in rigs:
+        points.append(
+            {
+                "measurement": "nicehash_rigs",
+                "tags": {"rig": rig["rigId"], "rig_name": rig.get("name", "")},
+                "fields": {
+                    "profitability": float(rig.get("profitability", 0)),
+                    "local_profitability": float(rig.get("localProfitability", 0)),
+                    "devices": len(rig.get("devices", [])),
+                },
+            }
+        )
+
+    fields, hashrates = fleet_aggregates(columns)
+    points.append({"measurement": "nicehash_fleet", "fields": fields})
+    for algorithm, hashrate in hashrates.items():
+        points.append(
+            {
+                "measurement": "nicehash_fleet_hashrate",
+                "tags": {"algorithm": algorithm},
+                "fields": {"hashrate": hashrate},
+            }
+        )
+    for point in points:
+        point["time"] = at
+    return points
+
+
+def poll_once(private, public, writer, timeout=CYCLE_TIMEOUT):
+    """Fetches balance, BTC price and rigs concurrently and writes whatever
+    arrived within ``timeout`` seconds. Fields that depend on a failed or
+    slow call are left out of the point. Each cycle gets its own threads,
+    so a call still running past the deadline cannot hold up the next."""
+    deadline = monotonic() + timeout
+    executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="nicehash")
+    futures = {
+        "accounts": executor.submit(private.get_accounts),
+        "prices": executor.submit(public.get_exchange_prices),
+        "rigs": executor.submit(public.get_mining_rigs, MINING_ADDRESS),
+    }
+    executor.shutdown(wait=False)
+    results = {}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result(timeout=max(0, deadline - monotonic()))
+        except Exception as e:
+            print(f"NiceHash {name} request failed: {e!r}")
+
+    at = time_ns()
+    fields = {}
+    usdrate = results["prices"]["BTCUSDC"] if "prices" in results else None
+
+    if "accounts" in results:
+        balance = results["accounts"]["currencies"][0]["totalBalance"]
+        fields["nicehash_wallet_balance"] = balance
+        if usdrate is not None:
+            fields["nicehash_wallet_balance_usd"] = float(balance) * float(usdrate)
+
+    if "rigs" in results:
+        raw = results["rigs"]
+        fields["active_devices"] = raw["totalDevices"]
+        if usdrate is not None:
+            btc_tp_per_24_hour = raw["totalProfitability"]
+            usd_tp_per_24_hour = btc_tp_per_24_hour * usdrate
+            fields["per_month_profitability"] = usd_tp_per_24_hour * 30
+
+    json_body = (
+        [{"measurement": "nicehash", "time": at, "fields": fields}] if fields else []
+    )
+    details = rig_points(results["rigs"], at) if "rigs" in results else []
+    writer.write(json_body + details)
+    return json_body
+
+
+def create_apis():
+    """Returns (private_api, public_api) clients sharing one session."""
     apikey = os.getenv("NICEHASH_APIKEY")
     apisecret = os.getenv("NICEHASH_APISECRET")
     org = os.getenv("NICEHASH_ORG")
+    timeout = min(float(os.getenv("NICEHASH_TIMEOUT", 10)), request_timeout())
 
-    private_api = private_api("https://api2.nicehash.com", org, apikey, apisecret)
+    session = create_session()
+    return (
+        private_api(HOST, org, apikey, apisecret, session=session, timeout=timeout),
+        public_api(HOST, session=session, timeout=timeout),
+    )
 
-    while True:
-        btc = private_api.get_accounts()["currencies"][0]
-        available = btc["available"]
-        balance = btc["totalBalance"]
-
-        usdrate = requests.get(
-            "https://api2.nicehash.com/exchange/api/v2/info/prices"
-        ).json()["BTCUSDC"]
-
-        raw = requests.get(
-            "https://api2.nicehash.com/main/api/v2/mining/external/3M6uRT9JF7VeSKQqtwzSUJZfgVWGW4xvw2/rigs2"
-        ).json()
-        rigs = raw["miningRigs"]
-        btc_tp_per_24_hour = raw["totalProfitability"]
-        usd_tp_per_24_hour = btc_tp_per_24_hour * usdrate
-        per_month_profitability = usd_tp_per_24_hour * 30
-
-        json_body = [
-            {
-                "measurement": "nicehash",
-                "fields": {
-                    "active_devices": raw["totalDevices"],
-                    "per_month_profitability": per_month_profitability,
-                    "nicehash_wallet_balance": balance,
-                    "nicehash_wallet_balance_usd": float(balance) * float(usdrate),
-                },
-            }
-        ]
 
-        client.write_points(json_body)
-        pprint.pprint(json_body)
+def main():
+    private, public = create_apis()
+    writer = create_writer()
+
+    while True:
+        pprint.pprint(poll_once(private, public, writer))
         sleep(10)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+""" asyncio variants of the NiceHash API clients, built on aiohttp. """
+
+import asyncio
+import json
+import aiohttp
+from nicehash import HOST, private_api, public_api
+
+
+class _AsyncTransport:
+    """Replaces the blocking ``request`` of an API client with a coroutine.
+
+    The endpoint methods inherited from the blocking clients return
+    ``self.request(...)`` directly, so on these classes they return awaitables
+    and are used as ``await api.get_accounts()``.
+    """
+
+    def _init_transport(self, session, timeout, pool_size):
+        self.session = session
+        self._owns_session = session is None
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._pool_size = pool_size
+
+    def _get_session(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._pool_size),
+                timeout=self._timeout,
+            )
+        return self.session
+
+    async def _send(self, method, url, headers, body_json):
+        async with self._get_session().request(
+            method, url, headers=headers, data=body_json
+        ) as response:
+            if response.status == 200:
+                return await response.json(content_type=None)
+            content = await response.read()
+            if content:
+                raise Exception(
+                    str(response.status)
+                    + ": "
+                    + str(response.reason)
+                    + ": "
+                    + str(content)
+                )
+            raise Exception(str(response.status) + ": " + str(response.reason))
+
+    def _url(self, method, path, query):
+        url = self.host + path
+        if query:
+            url += "?" + query
+        if self.verbose:
+            print(method, url)
+        return url
+
+    async def close(self):
+        if self._owns_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class AsyncPublicApi(_AsyncTransport, public_api):
+    def __init__(
+        self, host=HOST, verbose=False, session=None, timeout=10, pool_size=20
+    ):
+        self.host = host
+        self.verbose = verbose
+        self._init_transport(session, timeout, pool_size)
+
+    async def request(self, method, path, query, body):
+        body_json = json.dumps(body) if body else None
+        headers = {"Content-Type": "application/json"} if body_json else None
+        return await self._send(
+            method, self._url(method, path, query), headers, body_json
+        )
+
+
+class AsyncPrivateApi(_AsyncTransport, private_api):
+    def __init__(
+        self,
+        host,
+        organisation_id,
+        key,
+        secret,
+        verbose=False,
+        session=None,
+        timeout=10,
+        pool_size=20,
+    ):
+        self.key = key
+        self.secret = secret
+        self.organisation_id = organisation_id
+        self.host = host
+        self.verbose = verbose
+        self._signing_prefix = None
+        self._init_transport(session, timeout, pool_size)
+
+    async def request(self, method, path, query, body):
+        body_json = json.dumps(body) if body else None
+        headers = self.signed_headers(method, path, query, body_json)
+        return await self._send(
+            method, self._url(method, path, query), headers, body_json
+        )
+
+
+async def gather_by_key(calls):
+    """Awaits a dict of awaitables concurrently and returns a dict of results.
+    A failed call maps to its exception instead of failing the rest."""
+    keys = list(calls)
+    results = await asyncio.gather(*calls.values(), return_exceptions=True)
+    return dict(zip(keys, results))
@@ -0,0 +1,304 @@
+"""
+Tracks NiceHash hashpower and exchange order books and writes only changes.
+
+Each book is kept in memory as price -> quantity per side. Successive
+snapshots are diffed, and of the top levels, tagged by their rank from the
+best price, only those that changed are written, together with derived stats
+(best price, spread, depth within N% of best). Prices are fields, so the
+number of series stays bounded however the book moves.
+"""
+
+import asyncio
+import os
+import time
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, Iterable, List, Optional, Tuple
+from influx_writer import BatchWriter, create_writer
+from nicehash import HOST
+from nicehash_async import AsyncPrivateApi, AsyncPublicApi, gather_by_key
+
+DEPTH_PERCENTS = (1, 5)
+MAX_LEVELS = 20
+
+
+class BookSide:
+    """One side of an order book with its prices kept sorted."""
+
+    def __init__(self, descending: bool):
+        """
+        Args:
+            descending (bool): True for bids, where the best price is highest.
+        """
+        self.descending = descending
+        self.levels: Dict[float, float] = {}
+        self._prices: List[float] = []
+
+    def apply_snapshot(self, snapshot: Dict[float, float]) -> List[Tuple[float, float]]:
+        """
+        Replace the side with a snapshot and return the levels that changed.
+
+        Args:
+            snapshot (Dict[float, float]): Price to quantity.
+
+        Returns:
+            List[Tuple[float, float]]: (price, new quantity) for every changed
+            level; removed levels have quantity 0.
+        """
+        changes = []
+        for price in [p for p in self.levels if p not in snapshot]:
+            del self.levels[price]
+            del self._prices[bisect_left(self._prices, price)]
+            changes.append((price, 0.0))
+        for price, quantity in snapshot.items():
+            previous = self.levels.get(price)
+            if previous == quantity:
+                continue
+            if previous is None:
+                insort(self._prices, price)
+            self.levels[price] = quantity
+            changes.append((price, quantity))
+        return changes
+
+    def best(self) -> Optional[float]:
+        """Return the best price, or None if the side is empty."""
+        if not self._prices:
+            return None
+        return self._prices[-1] if self.descending else self._prices[0]
+
+    def top(self, count: int) -> List[Tuple[float, float]]:
+        """Return (price, quantity) of the ``count`` best levels, best first."""
+        prices = (
+            self._prices[-count:][::-1] if self.descending else self._prices[:count]
+        )
+        return [(p, self.levels[p]) for p in prices]
+
+    def depth(self, percent: float) -> float:
+        """Return the total quantity priced within ``percent`` of the best."""
+        best = self.best()
+        if best is None:
+            return 0.0
+        if self.descending:
+            start = bisect_left(self._prices, best * (1 - percent / 100))
+            prices = self._prices[start:]
+        else:
+            end = bisect_right(self._prices, best * (1 + percent / 100))
+            prices = self._prices[:end]
+        return sum(self.levels[p] for p in prices)
+
+
+class OrderBookTracker:
+    """Keeps every tracked book and turns snapshots into Influx points."""
+
+    def __init__(
+        self,
+        depth_percents: Iterable[float] = DEPTH_PERCENTS,
+        max_levels: int = MAX_LEVELS,
+    ):
+        """
+        Args:
+            depth_percents (Iterable[float]): Depth stats to compute, as
+                percentages from the best price.
+            max_levels (int): Levels per side written to
+                ``nicehash_orderbook_levels``, counted from the best price.
+        """
+        self.depth_percents = tuple(depth_percents)
+        self.max_levels = max_levels
+        self.books: Dict[Tuple[str, str], Dict[str, BookSide]] = {}
+
+    def update(
+        self,
+        kind: str,
+        name: str,
+        bids: Dict[float, float],
+        asks: Dict[float, float],
+        at: int,
+    ) -> List[Dict]:
+        """
+        Apply a snapshot of one book.
+
+        Level points are tagged with ``level``, the rank from the best
+        price, and carry the price and quantity as fields. A rank that no
+        longer has a level is written with quantity 0 and no price.
+
+        Args:
+            kind (str): "exchange" or "hashpower".
+            name (str): Market or algorithm/region of the book.
+            bids (Dict[float, float]): Bid price to quantity.
+            asks (Dict[float, float]): Ask price to quantity.
+            at (int): Snapshot time in nanoseconds.
+
+        Returns:
+            List[Dict]: Points for the changed levels and the book stats.
+        """
+        book = self.books.setdefault(
+            (kind, name), {"bid": BookSide(True), "ask": BookSide(False)}
+        )
+        tags = {"kind": kind, "book": name}
+        points = []
+        for side, snapshot in (("bid", bids), ("ask", asks)):
+            before = book[side].top(self.max_levels)
+            if not book[side].apply_snapshot(snapshot):
+                continue
+            after = book[side].top(self.max_levels)
+            for rank in range(max(len(before), len(after))):
+                level = after[rank] if rank < len(after) else None
+                if rank < len(before) and before[rank] == level:
+                    continue
+                if level is None:
+                    fields = {"quantity": 0.0}
+                else:
+                    fields = {"price": level[0], "quantity": level[1]}
+                points.append(
+                    {
+                        "measurement": "nicehash_orderbook_levels",
+                        "tags": {**tags, "side": side, "level": str(rank)},
+                        "time": at,
+                        "fields": fields,
+                    }
+                )
+
+        stats: Dict[str, float] = {}
+        for side, levels in book.items():
+            best = levels.best()
+            if best is not None:
+                stats[f"best_{side}"] = best
+            stats[f"{side}_levels"] = len(levels.levels)
+            for percent in self.depth_percents:
+                stats[f"{side}_depth_{percent:g}pct"] = levels.depth(percent)
+        if "best_bid" in stats and "best_ask" in stats:
+            stats["spread"] = stats["best_ask"] - stats["best_bid"]
+        points.append(
+            {
+                "measurement": "nicehash_orderbook",
+                "tags": tags,
+                "time": at,
+                "fields": stats,
+            }
+        )
+        return points
+
+    def update_exchange(self, market: str, response: Dict, at: int) -> List[Dict]:
+        """
+        Apply a ``get_exchange_orderbook`` response.
+
+        Args:
+            market (str): Exchange market, e.g. "BTCUSDT".
+            response (Dict): Response with ``buy``/``sell`` [price, qty] lists.
+            at (int): Snapshot time in nanoseconds.
+
+        Returns:
+            List[Dict]: Points to write.
+        """
+        return self.update(
+            "exchange",
+            market,
+            _sum_levels((p, q) for p, q in response.get("buy", [])),
+            _sum_levels((p, q) for p, q in response.get("sell", [])),
+            at,
+        )
+
+    def update_hashpower(self, algorithm: str, response: Dict, at: int) -> List[Dict]:
+        """
+        Apply a ``get_hashpower_orderbook`` response.
+
+        Hashpower books only have buy orders; each region becomes its own
+        book, with the accepted speed at each price as the quantity.
+
+        Args:
+            algorithm (str): Mining algorithm, e.g. "SHA256".
+            response (Dict): Response with per-region ``stats``.
+            at (int): Snapshot time in nanoseconds.
+
+        Returns:
+            List[Dict]: Points to write.
+        """
+        points = []
+        for region, stats in response.get("stats", {}).items():
+            bids = _sum_levels(
+                (order["price"], order.get("acceptedSpeed", 0))
+                for order in stats.get("orders", [])
+                if order.get("alive", True)
+            )
+            points += self.update("hashpower", f"{algorithm}/{region}", bids, {}, at)
+        return points
+
+
+def _sum_levels(orders: Iterable[Tuple]) -> Dict[float, float]:
+    levels: Dict[float, float] = {}
+    for price, quantity in orders:
+        price = float(price)
+        levels[price] = levels.get(price, 0.0) + float(quantity)
+    return levels
+
+
+async def poll_books(
+    private: AsyncPrivateApi,
+    public: AsyncPublicApi,
+    tracker: OrderBookTracker,
+    writer: BatchWriter,
+    algorithms: List[str],
+    markets: List[str],
+    limit: int = 100,
+) -> None:
+    """
+    Fetch every tracked book concurrently and write the changes.
+
+    Args:
+        private (AsyncPrivateApi): Client for hashpower books.
+        public (AsyncPublicApi): Client for exchange books.
+        tracker (OrderBookTracker): Book state.
+        writer (BatchWriter): Shared InfluxDB writer.
+        algorithms (List[str]): Hashpower algorithms to track.
+        markets (List[str]): Exchange markets to track.
+        limit (int): Exchange book depth to request.
+    """
+    calls = {("hashpower", a): private.get_hashpower_orderbook(a) for a in algorithms}
+    calls.update(
+        {("exchange", m): public.get_exchange_orderbook(m, limit) for m in markets}
+    )
+    results = await gather_by_key(calls)
+    at = time.time_ns()
+
+    points = []
+    for (kind, name), result in results.items():
+        if isinstance(result, Exception):
+            print(f"{kind} order book {name} failed: {result!r}")
+        elif kind == "hashpower":
+            points += tracker.update_hashpower(name, result, at)
+        else:
+            points += tracker.update_exchange(name, result, at)
+    writer.write(points)
+
+
+def _env_list(name: str) -> List[str]:
+    return [item for item in os.getenv(name, "").split(",") if item]
+
+
+async def run(interval: float) -> None:
+    algorithms = _env_list("NICEHASH_ORDERBOOK_ALGORITHMS")
+    markets = _env_list("NICEHASH_ORDERBOOK_MARKETS")
+    tracker = OrderBookTracker(
+        max_levels=int(os.getenv("NICEHASH_ORDERBOOK_LEVELS", MAX_LEVELS))
+    )
+    writer = create_writer()
+
+    async with AsyncPrivateApi(
+        HOST,
+        os.getenv("NICEHASH_ORG"),
+        os.getenv("NICEHASH_APIKEY"),
+        os.getenv("NICEHASH_APISECRET"),
+    ) as private, AsyncPublicApi(HOST) as public:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while True:
+            await poll_books(private, public, tracker, writer, algorithms, markets)
+            deadline += interval
+            await asyncio.sleep(max(0.0, deadline - loop.time()))
+
+
+def main():
+    asyncio.run(run(float(os.getenv("NICEHASH_ORDERBOOK_INTERVAL", 10))))
+
+
+if __name__ == "__main__":
+    main()
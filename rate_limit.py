@@ -0,0 +1,90 @@
+"""
+Client-side rate limiting helpers for polling third-party APIs.
+"""
+
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    """Allows ``rate`` calls per second on average, with bursts of ``capacity``."""
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        Args:
+            rate (float): Tokens added per second.
+            capacity (float): Maximum number of stored tokens.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """
+        Take tokens if they are available.
+
+        Args:
+            tokens (float): Number of tokens to take.
+
+        Returns:
+            bool: Whether the tokens were taken.
+        """
+        with self._lock:
+            self._fill()
+            if self._tokens < tokens:
+                return False
+            self._tokens -= tokens
+            return True
+
+    def wait_time(self, tokens: float = 1.0) -> float:
+        """Return the seconds until ``tokens`` will be available."""
+        with self._lock:
+            self._fill()
+            return max(0.0, (tokens - self._tokens) / self.rate)
+
+    def _fill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+
+class Backoff:
+    """Exponential backoff with random jitter."""
+
+    def __init__(self, base: float = 1.0, maximum: float = 600.0):
+        """
+        Args:
+            base (float): Delay after the first failure, in seconds.
+            maximum (float): Upper bound on the delay, in seconds.
+        """
+        self.base = base
+        self.maximum = maximum
+        self.failures = 0
+        self.until = 0.0
+
+    def failure(self) -> float:
+        """
+        Record a failure and return how long to hold off.
+
+        Returns:
+            float: Seconds to wait before the next attempt.
+        """
+        self.failures += 1
+        ceiling = min(self.maximum, self.base * 2 ** (self.failures - 1))
+        delay = random.uniform(ceiling / 2, ceiling)
+        self.until = time.monotonic() + delay
+        return delay
+
+    def success(self) -> None:
+        """Reset after a successful attempt."""
+        self.failures = 0
+        self.until = 0.0
+
+    def remaining(self) -> float:
+        """Return the seconds left in the current backoff period."""
+        return max(0.0, self.until - time.monotonic())
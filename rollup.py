@@ -0,0 +1,144 @@
+"""
+Streaming downsampling stage for the batch writer.
+
+Keeps running min/max/mean/last per numeric field for each series and window
+size, and emits one rollup point per series when a window closes, e.g. raw
+``allcrypto`` points produce ``allcrypto_1m`` and ``allcrypto_1h``.
+
+Windows of a quiet series are closed once the wall clock passes their end
+plus a grace period, which allows for points stamped before a slow poll
+returned. Each window is emitted exactly once: points that still arrive for
+an already closed window are left out of the rollups (they are written raw)
+and counted in ``late_points``.
+"""
+
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_WINDOWS = {"1m": 60, "1h": 3600}
+DEFAULT_GRACE = 10
+
+SeriesKey = Tuple[str, str, Tuple[Tuple[str, str], ...]]
+
+
+class _Window:
+    """Aggregates for one series over one window."""
+
+    __slots__ = ("start", "end", "tags", "stats")
+
+    def __init__(self, start: int, end: int, tags: Dict[str, str]):
+        self.start = start
+        self.end = end
+        self.tags = tags
+        # field -> [min, max, sum, count, last]
+        self.stats: Dict[str, list] = {}
+
+    def add(self, fields: Dict) -> None:
+        for name, value in fields.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            stat = self.stats.get(name)
+            if stat is None:
+                self.stats[name] = [value, value, value, 1, value]
+            else:
+                if value < stat[0]:
+                    stat[0] = value
+                if value > stat[1]:
+                    stat[1] = value
+                stat[2] += value
+                stat[3] += 1
+                stat[4] = value
+
+    def to_point(self, measurement: str) -> Dict:
+        fields = {}
+        for name, (lo, hi, total, count, last) in self.stats.items():
+            fields[f"{name}_min"] = lo
+            fields[f"{name}_max"] = hi
+            fields[f"{name}_mean"] = total / count
+            fields[f"{name}_last"] = last
+        point = {"measurement": measurement, "time": self.start, "fields": fields}
+        if self.tags:
+            point["tags"] = self.tags
+        return point
+
+
+class RollupAggregator:
+    """Writer stage that adds windowed rollups of raw points."""
+
+    def __init__(
+        self,
+        measurements: Optional[Iterable[str]] = None,
+        windows: Optional[Dict[str, int]] = None,
+        grace: float = DEFAULT_GRACE,
+    ):
+        """
+        Args:
+            measurements (Optional[Iterable[str]]): Measurements to roll up.
+                None rolls up every measurement.
+            windows (Optional[Dict[str, int]]): Suffix to window length in
+                seconds. Defaults to 1 minute and 1 hour.
+            grace (float): Seconds past a window's end, by the wall clock,
+                before a quiet series' window is closed.
+        """
+        self.measurements = set(measurements) if measurements is not None else None
+        self.windows = {
+            suffix: seconds * 1_000_000_000
+            for suffix, seconds in (windows or DEFAULT_WINDOWS).items()
+        }
+        self.grace = int(grace * 1_000_000_000)
+        self.late_points = 0
+        self._open: Dict[SeriesKey, _Window] = {}
+        self._closed_until: Dict[SeriesKey, int] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, points: List[Dict]) -> List[Dict]:
+        """
+        Fold points into the open windows.
+
+        Args:
+            points (List[Dict]): Timestamped points headed for the writer.
+
+        Returns:
+            List[Dict]: The input points followed by any closed rollups.
+        """
+        rollups: List[Dict] = []
+        with self._lock:
+            for point in points:
+                measurement = point["measurement"]
+                if (
+                    self.measurements is not None
+                    and measurement not in self.measurements
+                ):
+                    continue
+                at = point["time"]
+                tags = point.get("tags") or {}
+                tag_key = tuple(sorted(tags.items()))
+                for suffix, length in self.windows.items():
+                    key = (suffix, measurement, tag_key)
+                    if at < self._closed_until.get(key, 0):
+                        self.late_points += 1
+                        continue
+                    window = self._open.get(key)
+                    if window is not None and at >= window.end:
+                        rollups.append(self._close(key, window))
+                        window = None
+                    if window is None:
+                        start = at - at % length
+                        window = _Window(start, start + length, dict(tags))
+                        self._open[key] = window
+                    window.add(point["fields"])
+
+            # Close windows of series that have gone quiet.
+            cutoff = time.time_ns() - self.grace
+            for key, window in list(self._open.items()):
+                if cutoff >= window.end:
+                    rollups.append(self._close(key, window))
+
+        return points + rollups if rollups else points
+
+    def _close(self, key: SeriesKey, window: _Window) -> Dict:
+        suffix, measurement, _ = key
+        del self._open[key]
+        self._closed_until[key] = window.end
+        return window.to_point(f"{measurement}_{suffix}")
@@ -0,0 +1,75 @@
+"""
+Drift-free fixed-rate scheduling for polling loops.
+
+Ticks are scheduled against absolute deadlines on the monotonic clock, so
+time spent polling and writing does not accumulate into the period.
+"""
+
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class Tick:
+    """One scheduled tick of a FixedRateTicker."""
+
+    number: int
+    lateness: float
+    missed: int
+    late: bool
+
+
+class FixedRateTicker:
+    """Sleeps until successive deadlines spaced exactly ``period`` apart."""
+
+    def __init__(self, period: float, late_threshold: Optional[float] = None):
+        """
+        Args:
+            period (float): Seconds between ticks.
+            late_threshold (Optional[float]): A tick that wakes up more than
+                this many seconds after its deadline counts as late. Defaults
+                to a tenth of the period.
+        """
+        self.period = period
+        self.late_threshold = (
+            late_threshold if late_threshold is not None else period / 10
+        )
+        self.ticks = 0
+        self.late_ticks = 0
+        self.missed_ticks = 0
+        self._deadline: Optional[float] = None
+
+    def wait(self) -> Tick:
+        """
+        Sleep until the next deadline.
+
+        If the caller overran one or more whole periods, those deadlines are
+        counted as missed and skipped instead of firing back to back.
+
+        Returns:
+            Tick: Details of the tick that just fired.
+        """
+        now = time.monotonic()
+        if self._deadline is None:
+            self._deadline = now
+
+        missed = 0
+        if now - self._deadline >= self.period:
+            missed = int((now - self._deadline) // self.period)
+            self._deadline += missed * self.period
+            self.missed_ticks += missed
+
+        delay = self._deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+        lateness = max(0.0, time.monotonic() - self._deadline)
+        late = lateness > self.late_threshold
+        if late:
+            self.late_ticks += 1
+
+        tick = Tick(self.ticks, lateness, missed, late)
+        self.ticks += 1
+        self._deadline += self.period
+        return tick
@@ -1,77 +1,289 @@
+import codecs
+import json
 import os
 import time
 import base64
 import hmac
 import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterable, Iterator, Optional
 import requests
-from influxdb import InfluxDBClient
+from influx_writer import BatchWriter, create_writer
 from collections import defaultdict
 
+API_URL = "https://api.shrimpy.io"
+DEFAULT_WORKERS = 4
+# Times a request rejected for its nonce is re-signed and resent.
+NONCE_RETRIES = 3
 
-def get_shrimpy_balance(key: str, secret: str) -> dict:
-    """Request balance information from Shrimpy API.
+_session = requests.Session()
+
+
+class NonceCounter:
+    """Issues strictly increasing nonces, safe to share between threads.
+
+    Nonces follow the clock in units of 100 microseconds, but never repeat
+    or go backwards when several are taken within one tick.
+    """
+
+    def __init__(self):
+        self._last = 0
+        self._lock = threading.Lock()
+
+    def __call__(self) -> str:
+        with self._lock:
+            self._last = max(self._last + 1, int(time.time() * 10000))
+            return str(self._last)
+
+
+_nonce = NonceCounter()
+
+
+def signed_headers(key: str, secret: str, endpoint: str, method: str = "GET") -> dict:
+    """Build the authentication headers for a Shrimpy API request.
 
     Args:
         key (str): Shrimpy API key.
         secret (str): Shrimpy API secret.
+        endpoint (str): Request path, e.g. "/v1/accounts".
+        method (str): HTTP method.
 
     Returns:
-        dict: Balance information from Shrimpy API.
+        dict: Request headers.
     """
-    endpoint = "/v1/accounts"
-    nonce = str(int(time.time() * 10000))
-    sign_url = (endpoint + "GET" + nonce).encode("utf-8")
+    nonce = _nonce()
+    sign_url = (endpoint + method + nonce).encode("utf-8")
     signing = hmac.new(base64.b64decode(secret), sign_url, hashlib.sha256)
     signing_b64 = base64.b64encode(signing.digest()).decode("utf-8")
-    headers = {
+    return {
         "content-type": "application/json",
         "SHRIMPY-API-KEY": key,
         "SHRIMPY-API-NONCE": nonce,
         "SHRIMPY-API-SIGNATURE": signing_b64,
     }
-    response = requests.get("https://api.shrimpy.io" + endpoint, headers=headers)
-    return response.json()
 
 
-def post_to_influx(client: InfluxDBClient, data: dict) -> None:
+def is_nonce_rejection(response: requests.Response) -> bool:
+    """Whether Shrimpy refused the request because of its nonce.
+
+    Args:
+        response (requests.Response): Response to a signed request.
+
+    Returns:
+        bool: True if the request may succeed when re-signed.
+    """
+    return response.status_code in (400, 401) and "nonce" in response.text.lower()
+
+
+def signed_get(key: str, secret: str, endpoint: str, **kwargs) -> requests.Response:
+    """Send a signed GET, re-signing it if the nonce is rejected.
+
+    Shrimpy rejects a nonce that is not greater than the last one it saw
+    for the key. Concurrent requests can arrive out of nonce order, so such
+    rejections are retried with a fresh nonce up to ``NONCE_RETRIES`` times.
+
+    Args:
+        key (str): Shrimpy API key.
+        secret (str): Shrimpy API secret.
+        endpoint (str): Request path, e.g. "/v1/accounts".
+        **kwargs: Passed on to ``Session.get``.
+
+    Returns:
+        requests.Response: The last response.
+    """
+    for attempt in range(NONCE_RETRIES + 1):
+        response = _session.get(
+            API_URL + endpoint, headers=signed_headers(key, secret, endpoint), **kwargs
+        )
+        if attempt == NONCE_RETRIES or not is_nonce_rejection(response):
+            return response
+        response.close()
+    return response
+
+
+def get_shrimpy_balance(key: str, secret: str) -> dict:
+    """Request balance information from Shrimpy API.
+
+    Args:
+        key (str): Shrimpy API key.
+        secret (str): Shrimpy API secret.
+
+    Returns:
+        dict: Balance information from Shrimpy API.
+    """
+    return signed_get(key, secret, "/v1/accounts").json()
+
+
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator[Any]:
+    """Yield the elements of a JSON array as soon as each one is complete.
+
+    Only the undecoded tail of the body is buffered, so accounts can be
+    aggregated while the rest of the response is still arriving. The
+    elements are expected to be objects or arrays; a bare number split
+    across two chunks would be decoded early.
+
+    Args:
+        chunks (Iterable[bytes]): Raw UTF-8 body chunks.
+
+    Returns:
+        Iterator[Any]: Decoded array elements.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    started = False
+    for chunk in chunks:
+        buffer += text.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buffer):
+                break
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError(f"Expected a JSON array: {buffer[:200]!r}")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break
+            yield item
+        buffer = buffer[pos:]
+    raise ValueError(f"Truncated JSON array: {buffer[:200]!r}")
+
+
+def stream_shrimpy_accounts(key: str, secret: str) -> Iterator[dict]:
+    """Stream the accounts from Shrimpy API, one account at a time.
+
+    Args:
+        key (str): Shrimpy API key.
+        secret (str): Shrimpy API secret.
+
+    Returns:
+        Iterator[dict]: Accounts as they are decoded.
+    """
+    with signed_get(key, secret, "/v1/accounts", stream=True) as response:
+        response.raise_for_status()
+        yield from iter_json_array(response.iter_content(chunk_size=16384))
+
+
+def get_account_balance(key: str, secret: str, account: dict) -> dict:
+    """Request the balance of one account and attach it to the account.
+
+    Args:
+        key (str): Shrimpy API key.
+        secret (str): Shrimpy API secret.
+        account (dict): Account from the accounts list.
+
+    Returns:
+        dict: The account with ``balance`` set to its assets.
+    """
+    response = signed_get(key, secret, f"/v1/accounts/{account['id']}/balance")
+    response.raise_for_status()
+    return {**account, "balance": response.json().get("balances", [])}
+
+
+def iter_account_balances(
+    key: str, secret: str, workers: int = DEFAULT_WORKERS
+) -> Iterator[dict]:
+    """Fetch every account's balance endpoint concurrently.
+
+    Balance requests start as soon as their account is decoded from the
+    streamed list, and accounts are yielded in completion order. A failed
+    request fails the whole poll rather than posting a partial total.
+
+    All requests share the API key's nonce sequence. Concurrent requests
+    can reach Shrimpy out of nonce order and be rejected, so keep
+    ``workers`` small; rejected requests are re-signed by ``signed_get``.
+
+    Args:
+        key (str): Shrimpy API key.
+        secret (str): Shrimpy API secret.
+        workers (int): Maximum concurrent balance requests.
+
+    Returns:
+        Iterator[dict]: Accounts with their ``balance`` attached.
+    """
+    with ThreadPoolExecutor(workers, thread_name_prefix="shrimpy") as executor:
+        futures = [
+            executor.submit(get_account_balance, key, secret, account)
+            for account in stream_shrimpy_accounts(key, secret)
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def aggregate_balances(accounts: Iterable[dict]) -> Dict[str, float]:
+    """Sum per-exchange asset values and the total in a single pass.
+
+    Args:
+        accounts (Iterable[dict]): Accounts with a ``balance`` asset list.
+
+    Returns:
+        Dict[str, float]: Fields keyed "<exchange>_balance_<symbol>_usd",
+        plus "total_usd".
+    """
+    to_post: Dict[str, float] = defaultdict(float)
+    total_balance = 0.0
+    for account in accounts:
+        prefix = f"{account['exchange']}_balance_"
+        for asset in account.get("balance", []):
+            usd_value = float(asset["usdValue"])
+            to_post[f"{prefix}{asset['symbol']}_usd"] += usd_value
+            total_balance += usd_value
+
+    to_post["total_usd"] = total_balance
+    return to_post
+
+
+def post_to_influx(writer: BatchWriter, data: dict) -> None:
     """Post data to InfluxDB.
 
     Args:
-        client (InfluxDBClient): InfluxDB client instance.
+        writer (BatchWriter): Shared InfluxDB writer.
         data (dict): Data to post to InfluxDB.
     """
     json_body = [{"measurement": "crypto_balance", "fields": data}]
-    client.write_points(json_body)
+    writer.write(json_body)
+
+
+def poll_once(
+    writer: BatchWriter, key: str, secret: str, per_account: Optional[bool] = None
+) -> None:
+    """Fetch balances from Shrimpy and post per-asset USD values.
+
+    Args:
+        writer (BatchWriter): Shared InfluxDB writer.
+        key (str): Shrimpy API key.
+        secret (str): Shrimpy API secret.
+        per_account (Optional[bool]): Query each account's balance endpoint
+            concurrently instead of reading balances from the accounts list.
+            Defaults to the SHRIMPY_PER_ACCOUNT environment variable.
+    """
+    if per_account is None:
+        per_account = os.getenv("SHRIMPY_PER_ACCOUNT", "0") == "1"
+    if per_account:
+        workers = int(os.getenv("SHRIMPY_WORKERS", DEFAULT_WORKERS))
+        accounts = iter_account_balances(key, secret, workers)
+    else:
+        accounts = stream_shrimpy_accounts(key, secret)
+    post_to_influx(writer, aggregate_balances(accounts))
 
 
 def main():
-    influx_client = InfluxDBClient(
-        host=os.getenv("INFLUX_HOSTNAME"),
-        port=8086,
-        username=os.getenv("INFLUX_USERNAME"),
-        password=os.getenv("INFLUX_PASSWORD"),
-        database=os.getenv("INFLUX_DATABASE"),
-    )
+    writer = create_writer()
 
     shrimpy_key = os.getenv("SHRIMPY_API_KEY")
     shrimpy_secret = os.getenv("SHRIMPY_API_SECRET")
 
     while True:
-        balance_data = get_shrimpy_balance(shrimpy_key, shrimpy_secret)
-        to_post = defaultdict(float)
-
-        total_balance = 0.0
-        for account in balance_data:
-            account_balance = account.get("balance", [])
-            usd_balance = sum(float(asset["usdValue"]) for asset in account_balance)
-            total_balance += usd_balance
-            for asset in account_balance:
-                to_post[
-                    f"{account['exchange']}_balance_{asset['symbol']}_usd"
-                ] += float(asset["usdValue"])
-
-        to_post["total_usd"] = total_balance
-        post_to_influx(influx_client, to_post)
+        poll_once(writer, shrimpy_key, shrimpy_secret)
         time.sleep(10)
 
 
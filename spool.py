@@ -0,0 +1,224 @@
+"""
+Disk-backed write-ahead spool for InfluxDB line protocol.
+
+Batches are appended to numbered segment files in a spool directory and a
+replayer thread drains the oldest sealed segments to InfluxDB. While the
+database is unreachable the spool keeps growing, up to ``max_bytes``, after
+which the oldest segments are discarded.
+"""
+
+import os
+import random
+import threading
+import time
+from typing import List, Optional, TextIO
+from influxdb import InfluxDBClient
+from influxdb.exceptions import InfluxDBClientError
+
+SEGMENT_SUFFIX = ".lp"
+
+
+class Spool:
+    """Append-only, segment-rotated line-protocol spool."""
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = 8 * 1024 * 1024,
+        max_bytes: int = 512 * 1024 * 1024,
+        fsync: bool = True,
+    ):
+        """
+        Args:
+            directory (str): Directory holding the segment files.
+            segment_bytes (int): Rotate the active segment past this size.
+            max_bytes (int): Upper bound on the total size of all segments.
+            fsync (bool): Sync each append to disk before returning.
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.dropped_bytes = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._active: Optional[TextIO] = None
+        self._active_path: Optional[str] = None
+        self._active_opened = 0.0
+        existing = self._segment_paths()
+        self._next_seq = self._seq(existing[-1]) + 1 if existing else 0
+
+    def append(self, lines: str) -> None:
+        """
+        Append newline-terminated line-protocol data to the active segment.
+
+        Args:
+            lines (str): One or more line-protocol lines.
+        """
+        if not lines:
+            return
+        with self._lock:
+            if self._active is None:
+                self._open_segment()
+            assert self._active is not None
+            self._active.write(lines if lines.endswith("\n") else lines + "\n")
+            self._active.flush()
+            if self.fsync:
+                os.fsync(self._active.fileno())
+            if self._active.tell() >= self.segment_bytes:
+                self._close_segment()
+            self._enforce_limit()
+
+    def seal(self, min_age: float = 0.0) -> None:
+        """
+        Close the active segment so the replayer can drain it.
+
+        Args:
+            min_age (float): Only seal if the segment is at least this old.
+        """
+        with self._lock:
+            if self._active is None:
+                return
+            if time.monotonic() - self._active_opened >= min_age:
+                self._close_segment()
+
+    def sealed_segments(self) -> List[str]:
+        """Return sealed segment paths, oldest first."""
+        with self._lock:
+            return [p for p in self._segment_paths() if p != self._active_path]
+
+    def size(self) -> int:
+        """Return the total size of all segments in bytes."""
+        total = 0
+        for path in self._segment_paths():
+            try:
+                total += os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+        return total
+
+    def close(self) -> None:
+        """Seal the active segment."""
+        self.seal()
+
+    def _segment_paths(self) -> List[str]:
+        names = sorted(
+            n for n in os.listdir(self.directory) if n.endswith(SEGMENT_SUFFIX)
+        )
+        return [os.path.join(self.directory, n) for n in names]
+
+    @staticmethod
+    def _seq(path: str) -> int:
+        return int(os.path.basename(path)[: -len(SEGMENT_SUFFIX)])
+
+    def _open_segment(self) -> None:
+        name = f"{self._next_seq:012d}{SEGMENT_SUFFIX}"
+        self._next_seq += 1
+        self._active_path = os.path.join(self.directory, name)
+        self._active = open(self._active_path, "a", encoding="utf-8")
+        self._active_opened = time.monotonic()
+
+    def _close_segment(self) -> None:
+        if self._active is not None:
+            self._active.close()
+        self._active = None
+        self._active_path = None
+
+    def _enforce_limit(self) -> None:
+        sealed = [p for p in self._segment_paths() if p != self._active_path]
+        total = self.size()
+        while total > self.max_bytes and sealed:
+            oldest = sealed.pop(0)
+            try:
+                freed = os.path.getsize(oldest)
+                os.remove(oldest)
+            except FileNotFoundError:
+                continue
+            total -= freed
+            self.dropped_bytes += freed
+            print(f"Spool over {self.max_bytes} bytes, dropped {oldest}")
+
+
+class Replayer:
+    """Background thread draining sealed spool segments to InfluxDB."""
+
+    def __init__(
+        self,
+        client: InfluxDBClient,
+        spool: Spool,
+        batch_lines: int = 5000,
+        seal_after: float = 5.0,
+        max_backoff: float = 300.0,
+    ):
+        """
+        Args:
+            client (InfluxDBClient): Client used to send batches.
+            spool (Spool): Spool to drain.
+            batch_lines (int): Lines sent per request.
+            seal_after (float): Seal the active segment after this many seconds
+                so recent points are not held back.
+            max_backoff (float): Upper bound on the retry delay, in seconds.
+        """
+        self.client = client
+        self.spool = spool
+        self.batch_lines = batch_lines
+        self.seal_after = seal_after
+        self.max_backoff = max_backoff
+
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="influx-replayer", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the replayer. Undelivered data stays on disk."""
+        self._stopping.set()
+        self._thread.join()
+
+    def drain(self) -> None:
+        """Send every sealed segment, deleting each once fully delivered."""
+        for path in self.spool.sealed_segments():
+            if self._stopping.is_set():
+                return
+            self._send_segment(path)
+
+    def _send_segment(self, path: str) -> None:
+        try:
+            with open(path, encoding="utf-8") as f:
+                lines = [line for line in f.read().splitlines() if line]
+        except FileNotFoundError:
+            return
+
+        backoff = 1.0
+        offset = 0
+        while offset < len(lines):
+            batch = lines[offset : offset + self.batch_lines]
+            try:
+                self.client.write_points(batch, protocol="line")
+            except Exception as e:
+                if isinstance(e, InfluxDBClientError) and e.code == 400:
+                    # Malformed data will never be accepted; skip it.
+                    print(f"Spool replay rejected {len(batch)} lines: {e}")
+                    offset += len(batch)
+                    continue
+                delay = backoff * random.uniform(0.5, 1.0)
+                print(f"Spool replay failed ({e}), retrying in {delay:.1f}s")
+                if self._stopping.wait(delay):
+                    return
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            offset += len(batch)
+            backoff = 1.0
+
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self.spool.seal(min_age=self.seal_after)
+            self.drain()
+            self._stopping.wait(1.0)
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The collector scripts live at the repository root, several with hyphenated
+# names, so tests import them with importlib.import_module.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
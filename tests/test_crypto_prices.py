@@ -0,0 +1,58 @@
+import importlib
+import json
+
+crypto_prices = importlib.import_module("crypto-prices")
+
+PAIR_IDS = {121: "USDT_BTC", 149: "USDT_ETH"}
+
+
+class RecordingWriter:
+    def __init__(self):
+        self.points = []
+
+    def write(self, points):
+        self.points += points
+
+
+def ticker_update(pair_id, last):
+    return json.dumps([1002, None, [pair_id, last, "0", "0", "0", "0"]])
+
+
+def test_stream_replays_updates_and_ignores_control_messages():
+    messages = [
+        json.dumps([1002, 1]),  # subscription acknowledgement
+        json.dumps([1010]),  # heartbeat
+        ticker_update(121, "30000.1234"),
+        ticker_update(999, "1.0"),  # untracked pair
+        ticker_update(149, "2000.5"),
+        ticker_update(149, "2000.5"),  # unchanged price
+    ]
+    connection = crypto_prices.StubConnection(messages)
+    writer = RecordingWriter()
+    stream = crypto_prices.TickerStream(
+        lambda: connection, PAIR_IDS, writer, min_interval=0
+    )
+
+    try:
+        stream.run_connection()
+    except ConnectionError:
+        pass
+
+    assert json.loads(connection.sent[0]) == {"command": "subscribe", "channel": 1002}
+    assert [p["fields"] for p in writer.points] == [
+        {"USDT_BTC": 30000.123},
+        {"USDT_BTC": 30000.123, "USDT_ETH": 2000.5},
+    ]
+    assert all(p["measurement"] == "cryptocurrency" for p in writer.points)
+
+
+def test_stream_coalesces_updates_within_min_interval():
+    writer = RecordingWriter()
+    stream = crypto_prices.TickerStream(None, PAIR_IDS, writer, min_interval=60)
+
+    stream.handle(ticker_update(121, "1.0"))
+    stream.handle(ticker_update(121, "2.0"))
+    stream.handle(ticker_update(149, "3.0"))
+
+    assert [p["fields"] for p in writer.points] == [{"USDT_BTC": 1.0}]
+    assert stream.prices == {"USDT_BTC": 2.0, "USDT_ETH": 3.0}
@@ -0,0 +1,57 @@
+import importlib
+
+import pytest
+
+water_level = importlib.import_module("water-level")
+
+
+class RecordingWriter:
+    def __init__(self):
+        self.points = []
+
+    def write(self, points):
+        self.points += points
+
+
+def test_filter_burst_rejects_outliers():
+    readings = [60.0, 60.4, 59.8, 60.2, 250.0, 3.0, 60.1]
+    assert water_level.filter_burst(readings) == pytest.approx(60.1, abs=0.3)
+
+
+def test_filter_burst_needs_agreeing_majority():
+    assert water_level.filter_burst([10.0, 100.0, 200.0, 300.0]) is None
+
+
+def test_sample_distance_filters_simulated_outliers():
+    backend = water_level.SimulatedBackend(
+        distance_cm=60.0, noise_cm=0.5, outlier_rate=0.2, seed=3
+    )
+    distance = water_level.sample_distance(backend, pings=15, spacing=0)
+    assert distance == pytest.approx(60.0, abs=1.0)
+
+
+def test_sample_distance_through_fake_gpio_edges():
+    backend = water_level.GPIOBackend(gpio=water_level.FakeGPIO(distance_cm=60.0))
+    try:
+        distance = water_level.sample_distance(backend, pings=5, spacing=0.01)
+    finally:
+        backend.close()
+    # Timer threads add scheduling jitter to each simulated edge.
+    assert distance == pytest.approx(60.0, abs=5.0)
+
+
+def test_sample_distance_without_echo():
+    backend = water_level.GPIOBackend(
+        gpio=water_level.FakeGPIO(distance_cm=None), timeout=0.01
+    )
+    assert water_level.sample_distance(backend, pings=3, spacing=0) is None
+
+
+def test_poll_once_writes_cistern_level():
+    backend = water_level.SimulatedBackend(distance_cm=60.0, noise_cm=0.1, seed=1)
+    writer = RecordingWriter()
+    water_level.poll_once(backend, writer, pings=9)
+    (point,) = writer.points
+    assert point["measurement"] == "cistern_level"
+    assert point["fields"]["distance_cm"] == pytest.approx(60.0, abs=0.5)
+    assert 0 <= point["fields"]["percent"] <= 100
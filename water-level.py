@@ -1,75 +1,595 @@
-""" 
+"""
 Uses Raspberry Pi GPIO-attached Ultrasonic sensor to measure water level in a cistern tank.
+
+Each sample is a burst of pings filtered into one distance: readings far from
+the burst median (ultrasonic multipath and missed echoes) are rejected and
+the rest are averaged with a trimmed mean. Samples are written to the
+``cistern_level`` measurement together with usage analytics (rolling fill or
+drain rate, litres consumed, time to empty) so dashboards only read last().
+
+Set ``CISTERN_BACKEND=simulated`` or ``fake`` to run the whole pipeline
+without a sensor.
 """
 
+import abc
+import math
+import os
+import random
+import statistics
+import threading
 import time
-import RPi.GPIO as GPIO
-from math import floor
-from collections import namedtuple
+from collections import deque, namedtuple
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+from influx_writer import BatchWriter, create_writer
+from scheduling import FixedRateTicker
 
 # GPIO Pins setup
 GPIO_TRIGGER = 3
 GPIO_ECHO = 2
 
-# GPIO Mode (BOARD / BCM)
-GPIO.setmode(GPIO.BCM)
+# Longest wait for an echo: the sensor's 4 m range is a ~23 ms round trip
+ECHO_TIMEOUT = 0.05
 
-# Set GPIO direction (IN / OUT)
-GPIO.setup(GPIO_TRIGGER, GPIO.OUT)
-GPIO.setup(GPIO_ECHO, GPIO.IN)
+# Sonic speed in cm/s
+SPEED_OF_SOUND = 34300
+
+# Default tank height in cm (example: 183 cm)
+TANK_HEIGHT = 183
+
+# Window for the rolling rate and change, in seconds
+RATE_WINDOW = 300
 
 # Namedtuple for storing measurement results
 Measurement = namedtuple("Measurement", ["percent_full", "distance_cm"])
 
 
-def measure_distance() -> Measurement:
+class SensorBackend(abc.ABC):
+    """Source of ultrasonic echo round-trip times."""
+
+    @abc.abstractmethod
+    def echo_time(self) -> Optional[float]:
+        """
+        Sends one ping and times its echo.
+
+        Returns:
+            Optional[float]: Round-trip time in seconds, or None if no echo.
+        """
+
+    def close(self) -> None:
+        """Releases the sensor."""
+
+
+class GPIOBackend(SensorBackend):
+    """HC-SR04 style sensor on Raspberry Pi GPIO pins.
+
+    By default the echo pulse is timed from edge interrupts: the pin's
+    edges are stamped with ``perf_counter_ns`` in the GPIO callback thread
+    while the caller sleeps on an event, so no core spins during a ping.
+    Edges are only collected while a ping is armed, from just before its
+    trigger until its echo completes or ``timeout`` passes; the first is the
+    echo's rise and the second its fall. Edges outside that window, such as
+    the tail of an echo that timed out, are ignored, and a ping waits for
+    the echo line to go low before it is armed.
     """
-    Measures the distance using ultrasonic sensor.
+
+    def __init__(
+        self,
+        trigger: int = GPIO_TRIGGER,
+        echo: int = GPIO_ECHO,
+        timeout: float = ECHO_TIMEOUT,
+        edge_events: bool = True,
+        gpio=None,
+    ):
+        """
+        Args:
+            trigger (int): BCM pin wired to the sensor's trigger.
+            echo (int): BCM pin wired to the sensor's echo.
+            timeout (float): Seconds to wait for a complete echo.
+            edge_events (bool): Time echoes from edge interrupts rather than
+                by polling the pin.
+            gpio: Module with the ``RPi.GPIO`` interface; defaults to
+                ``RPi.GPIO`` itself.
+        """
+        if gpio is None:
+            import RPi.GPIO
+
+            gpio = RPi.GPIO
+
+        self.GPIO = gpio
+        self.trigger = trigger
+        self.echo = echo
+        self.timeout = timeout
+        self.edge_events = edge_events
+        self._edges: List[int] = []
+        self._armed = False
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+        # GPIO Mode (BOARD / BCM)
+        gpio.setmode(gpio.BCM)
+
+        # Set GPIO direction (IN / OUT)
+        gpio.setup(trigger, gpio.OUT)
+        gpio.setup(echo, gpio.IN)
+
+        if edge_events:
+            gpio.add_event_detect(echo, gpio.BOTH, callback=self._on_edge)
+
+    def echo_time(self) -> Optional[float]:
+        if not self.edge_events:
+            return self._poll_echo_time()
+
+        if not self._wait_echo_low():
+            return None
+        self._done.clear()
+        with self._lock:
+            self._edges = []
+            self._armed = True
+        self._pulse_trigger()
+        self._done.wait(self.timeout)
+        with self._lock:
+            self._armed = False
+            edges = self._edges
+        if len(edges) < 2:
+            return None
+        rise, fall = edges
+        return (fall - rise) / 1e9
+
+    def _on_edge(self, channel: int) -> None:
+        now = time.perf_counter_ns()
+        with self._lock:
+            if not self._armed:
+                return
+            self._edges.append(now)
+            if len(self._edges) == 2:
+                self._armed = False
+                self._done.set()
+
+    def _wait_echo_low(self) -> bool:
+        # A previous echo may still be in progress after its ping timed out.
+        deadline = time.monotonic() + self.timeout
+        while self.GPIO.input(self.echo):
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.001)
+        return True
+
+    def _pulse_trigger(self) -> None:
+        # Set Trigger to HIGH
+        self.GPIO.output(self.trigger, True)
+
+        # Set Trigger after 0.01ms to LOW
+        time.sleep(0.00001)
+        self.GPIO.output(self.trigger, False)
+
+    def _poll_echo_time(self) -> Optional[float]:
+        GPIO = self.GPIO
+        self._pulse_trigger()
+        deadline = time.perf_counter_ns() + int(self.timeout * 1e9)
+
+        # Save start time
+        start_time = time.perf_counter_ns()
+        while GPIO.input(self.echo) == 0:
+            start_time = time.perf_counter_ns()
+            if start_time > deadline:
+                return None
+
+        # Save time of arrival
+        stop_time = time.perf_counter_ns()
+        while GPIO.input(self.echo) == 1:
+            stop_time = time.perf_counter_ns()
+            if stop_time > deadline:
+                return None
+
+        return (stop_time - start_time) / 1e9
+
+    def close(self) -> None:
+        if self.edge_events:
+            self.GPIO.remove_event_detect(self.echo)
+        self.GPIO.cleanup()
+
+
+class FakeGPIO:
+    """Stand-in for ``RPi.GPIO`` with a sensor wired to it.
+
+    A falling trigger schedules the echo pin to rise after the sensor's
+    start-up delay and fall after the round trip to ``distance_cm``, firing
+    any registered edge callbacks from a timer thread like the real module.
+    """
+
+    BCM = "BCM"
+    IN = "IN"
+    OUT = "OUT"
+    BOTH = "BOTH"
+
+    def __init__(self, distance_cm: float = 60.0, echo_delay: float = 0.0005):
+        """
+        Args:
+            distance_cm (float): Distance to the simulated water surface.
+                None simulates a lost echo.
+            echo_delay (float): Seconds between trigger and echo start.
+        """
+        self.distance_cm = distance_cm
+        self.echo_delay = echo_delay
+        self.levels: Dict[int, int] = {}
+        self.callbacks: Dict[int, Callable[[int], None]] = {}
+        self.echo: Optional[int] = None
+
+    def setmode(self, mode) -> None:
+        pass
+
+    def setup(self, pin: int, direction) -> None:
+        self.levels[pin] = 0
+        if direction == self.IN:
+            self.echo = pin
+
+    def input(self, pin: int) -> int:
+        return self.levels[pin]
+
+    def output(self, pin: int, value) -> None:
+        falling = self.levels.get(pin) and not value
+        self.levels[pin] = int(bool(value))
+        if falling and self.echo is not None and self.distance_cm is not None:
+            round_trip = 2 * self.distance_cm / SPEED_OF_SOUND
+            threading.Timer(self.echo_delay, self._set_echo, (1,)).start()
+            threading.Timer(self.echo_delay + round_trip, self._set_echo, (0,)).start()
+
+    def add_event_detect(self, pin: int, edge, callback) -> None:
+        self.callbacks[pin] = callback
+
+    def remove_event_detect(self, pin: int) -> None:
+        self.callbacks.pop(pin, None)
+
+    def cleanup(self) -> None:
+        self.callbacks.clear()
+
+    def _set_echo(self, value: int) -> None:
+        echo = self.echo
+        assert echo is not None
+        self.levels[echo] = value
+        if echo in self.callbacks:
+            self.callbacks[echo](echo)
+
+
+class SimulatedBackend(SensorBackend):
+    """Noisy simulated sensor above a slowly changing water surface."""
+
+    def __init__(
+        self,
+        distance_cm: float = 60.0,
+        noise_cm: float = 0.5,
+        outlier_rate: float = 0.05,
+        drift_cm_per_s: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        """
+        Args:
+            distance_cm (float): Initial distance to the water surface.
+            noise_cm (float): Standard deviation of normal readings.
+            outlier_rate (float): Fraction of pings that are lost or bogus.
+            drift_cm_per_s (float): Rate the distance changes, e.g. while
+                the tank drains.
+            seed (Optional[int]): Seed for repeatable runs.
+        """
+        self.distance_cm = distance_cm
+        self.noise_cm = noise_cm
+        self.outlier_rate = outlier_rate
+        self.drift_cm_per_s = drift_cm_per_s
+        self.random = random.Random(seed)
+        self.started = time.monotonic()
+
+    def echo_time(self) -> Optional[float]:
+        distance = self.distance_cm + self.drift_cm_per_s * (
+            time.monotonic() - self.started
+        )
+        if self.random.random() < self.outlier_rate:
+            if self.random.random() < 0.5:
+                return None
+            distance = self.random.uniform(2, 400)
+        else:
+            distance += self.random.gauss(0, self.noise_cm)
+        return 2 * distance / SPEED_OF_SOUND
+
+
+def filter_burst(
+    distances: List[float], max_deviation: float = 5.0, trim: float = 0.2
+) -> Optional[float]:
+    """
+    Combines one burst of readings into a single distance.
+
+    Args:
+        distances (List[float]): Distances in cm from the valid pings.
+        max_deviation (float): Readings further than this from the median,
+            in cm, are rejected as outliers.
+        trim (float): Fraction cut from each end before averaging.
+
+    Returns:
+        Optional[float]: Filtered distance in cm, or None if fewer than half
+        of the readings agree.
+    """
+    if not distances:
+        return None
+    median = statistics.median(distances)
+    kept = sorted(d for d in distances if abs(d - median) <= max_deviation)
+    if len(kept) * 2 < len(distances):
+        return None
+    cut = int(len(kept) * trim)
+    return statistics.fmean(kept[cut : len(kept) - cut])
+
+
+def sample_distance(
+    backend: SensorBackend, pings: int = 9, spacing: float = 0.06
+) -> Optional[float]:
+    """
+    Takes a burst of pings and returns the filtered distance.
+
+    Args:
+        backend (SensorBackend): Sensor to ping.
+        pings (int): Pings per burst.
+        spacing (float): Seconds between pings, so that late echoes of one
+            ping are not taken for the next.
+
+    Returns:
+        Optional[float]: Distance in cm, or None if the burst was unusable.
+    """
+    distances = []
+    for ping in range(pings):
+        if ping:
+            time.sleep(spacing)
+        elapsed = backend.echo_time()
+        if elapsed is not None:
+            # Divide by 2 for the round trip
+            distances.append(elapsed * SPEED_OF_SOUND / 2)
+    # Too many lost echoes make the burst unusable as well.
+    if len(distances) * 2 < pings:
+        return None
+    return filter_burst(distances)
+
+
+@dataclass
+class TankGeometry:
+    """Converts sensor distances into fill level and volume."""
+
+    height_cm: float = TANK_HEIGHT
+    sensor_offset_cm: float = 0.0
+    litres_per_cm: Optional[float] = None
+
+    @property
+    def capacity_litres(self) -> Optional[float]:
+        if self.litres_per_cm is None:
+            return None
+        return self.litres_per_cm * (self.height_cm - self.sensor_offset_cm)
+
+    def percent(self, distance_from_sensor: float) -> float:
+        """Returns the fill level for a distance to the water surface."""
+        depth = self.height_cm - distance_from_sensor
+        return depth / (self.height_cm - self.sensor_offset_cm) * 100
+
+    @classmethod
+    def from_env(cls) -> "TankGeometry":
+        """
+        Reads the tank geometry from the environment.
+
+        ``CISTERN_HEIGHT_CM`` is the distance from the sensor to the tank
+        floor and ``CISTERN_SENSOR_OFFSET_CM`` from the sensor to the full
+        level. Volume comes from ``CISTERN_LITRES_PER_CM``, or from
+        ``CISTERN_DIAMETER_CM`` for a round tank, or ``CISTERN_WIDTH_CM``
+        and ``CISTERN_LENGTH_CM`` for a rectangular one.
+
+        Returns:
+            TankGeometry: The configured geometry.
+        """
+        litres_per_cm = os.getenv("CISTERN_LITRES_PER_CM")
+        diameter = os.getenv("CISTERN_DIAMETER_CM")
+        width, length = os.getenv("CISTERN_WIDTH_CM"), os.getenv("CISTERN_LENGTH_CM")
+        if litres_per_cm:
+            per_cm: Optional[float] = float(litres_per_cm)
+        elif diameter:
+            per_cm = math.pi * (float(diameter) / 2) ** 2 / 1000
+        elif width and length:
+            per_cm = float(width) * float(length) / 1000
+        else:
+            per_cm = None
+        return cls(
+            height_cm=float(os.getenv("CISTERN_HEIGHT_CM", TANK_HEIGHT)),
+            sensor_offset_cm=float(os.getenv("CISTERN_SENSOR_OFFSET_CM", 0)),
+            litres_per_cm=per_cm,
+        )
+
+
+class UsageTracker:
+    """Incremental fill/drain analytics over a rolling window of levels.
+
+    The rate is the least-squares slope of the level over the window, which
+    is robust to the sensor noise left after burst filtering. Consumption
+    only counts drops larger than ``min_change`` percent below a reference
+    level, so sensor noise does not add up to phantom usage.
+    """
+
+    def __init__(
+        self,
+        geometry: TankGeometry,
+        window: float = RATE_WINDOW,
+        min_change: float = 0.5,
+    ):
+        """
+        Args:
+            geometry (TankGeometry): Tank used to convert percent to litres.
+            window (float): Seconds of history for the rate and change.
+            min_change (float): Smallest level change, in percent, that
+                counts as consumption or filling.
+        """
+        self.geometry = geometry
+        self.window = window
+        self.min_change = min_change
+        self.samples: Deque[Tuple[float, float]] = deque()
+        self._origin: Optional[float] = None
+        self._reference: Optional[float] = None
+
+    def update(self, at: float, percent: float) -> Dict[str, float]:
+        """
+        Adds a level sample and returns the derived fields.
+
+        Args:
+            at (float): Sample time in seconds on any steady clock.
+            percent (float): Fill level in percent.
+
+        Returns:
+            Dict[str, float]: Change over the window, rates, consumption
+            since the previous sample and, while draining, time to empty.
+        """
+        if self._origin is None:
+            self._origin = at
+        t = at - self._origin
+        self.samples.append((t, percent))
+        while t - self.samples[0][0] > self.window:
+            self.samples.popleft()
+
+        consumed = 0.0
+        if self._reference is None or percent > self._reference + self.min_change:
+            self._reference = percent
+        elif percent < self._reference - self.min_change:
+            consumed = self._reference - percent
+            self._reference = percent
+
+        rate = self._slope() * 3600
+        fields = {
+            "change_percent": percent - self.samples[0][1],
+            "rate_percent_per_hour": rate,
+            "consumed_percent": consumed,
+        }
+        if rate < 0:
+            fields["time_to_empty_hours"] = percent / -rate
+
+        capacity = self.geometry.capacity_litres
+        if capacity is not None:
+            litres_per_percent = capacity / 100
+            fields["volume_litres"] = percent * litres_per_percent
+            fields["rate_litres_per_hour"] = rate * litres_per_percent
+            fields["consumed_litres"] = consumed * litres_per_percent
+        return fields
+
+    def _slope(self) -> float:
+        n = len(self.samples)
+        if n < 2:
+            return 0.0
+        mean_t = sum(t for t, _ in self.samples) / n
+        mean_level = sum(level for _, level in self.samples) / n
+        covariance = sum(
+            (t - mean_t) * (level - mean_level) for t, level in self.samples
+        )
+        variance = sum((t - mean_t) ** 2 for t, _ in self.samples)
+        return covariance / variance if variance else 0.0
+
+
+def to_measurement(
+    distance_from_sensor: float, geometry: Optional[TankGeometry] = None
+) -> Measurement:
+    """
+    Converts a distance to the water surface into a fill level.
+
+    Args:
+        distance_from_sensor (float): Distance in cm.
+        geometry (Optional[TankGeometry]): Tank shape; defaults to a
+            ``TANK_HEIGHT`` deep tank.
 
     Returns:
         Measurement: A namedtuple containing the percentage of water in the tank and the distance measured by the sensor.
     """
-    # Set Trigger to HIGH
-    GPIO.output(GPIO_TRIGGER, True)
+    # Whole percent, rounded down, as the series has always been written.
+    percent_full = (geometry or TankGeometry()).percent(distance_from_sensor)
+    return Measurement(math.floor(percent_full), distance_from_sensor)
+
 
-    # Set Trigger after 0.01ms to LOW
-    time.sleep(0.00001)
-    GPIO.output(GPIO_TRIGGER, False)
+def measure_distance(
+    backend: SensorBackend, pings: int = 9, geometry: Optional[TankGeometry] = None
+) -> Optional[Measurement]:
+    """
+    Measures the distance using ultrasonic sensor.
 
-    start_time = time.time()
-    stop_time = time.time()
+    Args:
+        backend (SensorBackend): Sensor to ping.
+        pings (int): Pings per burst.
+        geometry (Optional[TankGeometry]): Tank shape.
 
-    # Save start time
-    while GPIO.input(GPIO_ECHO) == 0:
-        start_time = time.time()
+    Returns:
+        Optional[Measurement]: The filtered measurement, or None if the burst
+        was unusable.
+    """
+    distance = sample_distance(backend, pings)
+    if distance is None:
+        return None
+    return to_measurement(distance, geometry)
 
-    # Save time of arrival
-    while GPIO.input(GPIO_ECHO) == 1:
-        stop_time = time.time()
 
-    # Calculate time difference between start and arrival
-    time_elapsed = stop_time - start_time
+def poll_once(
+    backend: SensorBackend,
+    writer: BatchWriter,
+    pings: int = 9,
+    usage: Optional[UsageTracker] = None,
+) -> None:
+    """
+    Takes one filtered sample and enqueues it.
 
-    # Sonic speed (34300 cm/s), divide by 2 for the round trip
-    distance_from_sensor = (time_elapsed * 34300) / 2
+    Args:
+        backend (SensorBackend): Sensor to ping.
+        writer (BatchWriter): Shared InfluxDB writer.
+        pings (int): Pings per burst.
+        usage (Optional[UsageTracker]): Adds usage analytics to the point.
+    """
+    geometry = usage.geometry if usage else None
+    measurement = measure_distance(backend, pings, geometry)
+    if measurement is None:
+        print("Cistern burst rejected: too few consistent echoes")
+        return
+    fields = {
+        "percent": measurement.percent_full,
+        "distance_cm": measurement.distance_cm,
+    }
+    if usage:
+        # Analytics use the unrounded level; whole percents are too coarse
+        # for a rolling rate.
+        percent = usage.geometry.percent(measurement.distance_cm)
+        fields.update(usage.update(time.monotonic(), percent))
+    writer.write([{"measurement": "cistern_level", "fields": fields}])
 
-    # Tank height in cm (example: 183 cm)
-    total_height = 183
 
-    # Calculate the percentage of water in the tank
-    percent_full = floor((total_height - distance_from_sensor) / total_height * 100)
+def create_backend() -> SensorBackend:
+    """
+    Creates the sensor backend selected by ``CISTERN_BACKEND``.
 
-    return Measurement(percent_full, distance_from_sensor)
+    Returns:
+        SensorBackend: "gpio" (default), "gpio-poll" to time echoes by
+        polling the pin, "fake" for the GPIO code on a fake pin, or
+        "simulated".
+    """
+    backend = os.getenv("CISTERN_BACKEND", "gpio")
+    if backend == "simulated":
+        return SimulatedBackend()
+    if backend == "fake":
+        return GPIOBackend(gpio=FakeGPIO())
+    return GPIOBackend(edge_events=backend != "gpio-poll")
 
 
 def main():
+    backend = create_backend()
+    writer = create_writer()
+    ticker = FixedRateTicker(float(os.getenv("CISTERN_INTERVAL", 10)))
+    pings = int(os.getenv("CISTERN_PINGS", 9))
+    usage = UsageTracker(
+        TankGeometry.from_env(), float(os.getenv("CISTERN_RATE_WINDOW", RATE_WINDOW))
+    )
+
     try:
-        measurement = measure_distance()
-        print(f"Water level: {measurement.percent_full}%")
-        print(f"Distance from sensor: {measurement.distance_cm} cm")
+        while True:
+            ticker.wait()
+            poll_once(backend, writer, pings, usage)
     except KeyboardInterrupt:
         print("Measurement stopped by User")
-        GPIO.cleanup()
+    finally:
+        writer.close()
+        backend.close()
 
 
 if __name__ == "__main__":
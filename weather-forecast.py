@@ -1,38 +1,199 @@
-""" 
+"""
 Gets weather forecast from weather.com and writes to InfluxDB.
+
+Responses are cached according to their Cache-Control/Expires headers and
+revalidated with conditional requests, and an unchanged payload is neither
+parsed nor written again. Besides the narrative strings, each forecast day is
+written as a point timestamped at its validity time.
 """
 
+import email.utils
+import hashlib
+import json
 import os
+import re
 import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
 import requests
-from influxdb import InfluxDBClient
+from influx_writer import BatchWriter, create_writer
+
+
+class HttpCache:
+    """Fetches one URL at a time, honouring HTTP caching headers."""
+
+    def __init__(self, session: Optional[requests.Session] = None, timeout: float = 10):
+        """
+        Args:
+            session (Optional[requests.Session]): Keep-alive session to use.
+            timeout (float): Request timeout in seconds.
+        """
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.url: Optional[str] = None
+        self.digest: Optional[str] = None
+        self.expires_at = 0.0
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+
+    def fetch(self, url: str) -> Optional[bytes]:
+        """
+        Returns the body of ``url`` if it changed since the last call.
+
+        No request is made while the cached response is fresh. Otherwise
+        the request is conditional, and a 304 or a body with the same hash
+        counts as unchanged.
+
+        Args:
+            url (str): URL to fetch.
+
+        Returns:
+            Optional[bytes]: The new body, or None if unchanged.
+        """
+        if url != self.url:
+            self._reset(url)
+        elif time.time() < self.expires_at:
+            return None
+
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304:
+            self._update_validators(response)
+            return None
+        response.raise_for_status()
+        self._update_validators(response)
+
+        digest = hashlib.sha256(response.content).hexdigest()
+        if digest == self.digest:
+            return None
+        self.digest = digest
+        return response.content
+
+    def _reset(self, url: Optional[str]) -> None:
+        self.url = url
+        self.digest = None
+        self.expires_at = 0.0
+        self.etag = None
+        self.last_modified = None
+
+    def _update_validators(self, response: requests.Response) -> None:
+        self.etag = response.headers.get("ETag", self.etag)
+        self.last_modified = response.headers.get("Last-Modified", self.last_modified)
+        self.expires_at = time.time() + freshness(response.headers)
+
+
+def freshness(headers) -> float:
+    """
+    Returns how many seconds a response may be reused without revalidation.
+
+    Args:
+        headers: Response headers.
+
+    Returns:
+        float: Seconds of freshness; 0 if the response must be revalidated.
+    """
+    cache_control = headers.get("Cache-Control", "").lower()
+    if "no-cache" in cache_control or "no-store" in cache_control:
+        return 0.0
+    max_age = re.search(r"max-age=(\d+)", cache_control)
+    if max_age:
+        return max(0.0, int(max_age.group(1)) - float(headers.get("Age", 0)))
+    if "Expires" in headers:
+        try:
+            expires = email.utils.parsedate_to_datetime(headers["Expires"])
+            return max(0.0, expires.timestamp() - time.time())
+        except (TypeError, ValueError):
+            return 0.0
+    return 0.0
+
+
+@dataclass
+class ForecastState:
+    """What ``poll_once`` keeps between calls."""
+
+    cache: HttpCache = field(default_factory=HttpCache)
+    # Narrative point of the last forecast, re-submitted while unchanged.
+    last_points: List[Dict] = field(default_factory=list)
 
 
-def get_weather_forecast(api_key: str, geocode: str) -> dict:
+def get_weather_forecast(
+    cache: HttpCache, api_key: str, geocode: str
+) -> Optional[dict]:
     """
     Fetches the weather forecast from weather.com.
 
     Args:
+        cache (HttpCache): Cache the forecast is fetched through.
         api_key (str): API key for weather.com.
         geocode (str): Geocode for the location (latitude,longitude).
 
     Returns:
-        dict: Weather forecast data.
+        Optional[dict]: Weather forecast data, or None if unchanged.
     """
     url = f"https://api.weather.com/v3/wx/forecast/daily/5day?geocode={geocode}&units=e&language=en-US&format=json&apiKey={api_key}"
-    response = requests.get(url)
-    return response.json()
+    content = cache.fetch(url)
+    if content is None:
+        return None
+    return json.loads(content)
 
 
-def write_to_influx(client: InfluxDBClient, forecast_data: dict) -> None:
+def daily_points(forecast_data: dict) -> List[Dict]:
+    """
+    Builds one point per forecast day, timestamped at the day's validity time.
+
+    Later forecasts for the same day overwrite the earlier point.
+
+    Args:
+        forecast_data (dict): Weather forecast data.
+
+    Returns:
+        List[Dict]: ``weather_forecast_daily`` points.
+    """
+    daypart = (forecast_data.get("daypart") or [{}])[0]
+    precip = daypart.get("precipChance") or []
+    points = []
+    for day, valid_time in enumerate(forecast_data["validTimeUtc"]):
+        fields = {
+            "temperatureMax": forecast_data["temperatureMax"][day],
+            "temperatureMin": forecast_data["temperatureMin"][day],
+            "qpf": forecast_data["qpf"][day],
+            "qpfSnow": forecast_data["qpfSnow"][day],
+            # dayparts alternate day, night for each day
+            "precipChanceDay": _get(precip, 2 * day),
+            "precipChanceNight": _get(precip, 2 * day + 1),
+        }
+        fields = {k: float(v) for k, v in fields.items() if v is not None}
+        if fields:
+            points.append(
+                {
+                    "measurement": "weather_forecast_daily",
+                    "time": int(valid_time) * 1_000_000_000,
+                    "fields": fields,
+                }
+            )
+    return points
+
+
+def _get(values: list, index: int):
+    return values[index] if index < len(values) else None
+
+
+def write_to_influx(writer: BatchWriter, forecast_data: dict) -> List[Dict]:
     """
     Writes weather forecast data to InfluxDB.
 
     Args:
-        client (InfluxDBClient): InfluxDB client instance.
+        writer (BatchWriter): Shared InfluxDB writer.
         forecast_data (dict): Weather forecast data to write.
+
+    Returns:
+        List[Dict]: The narrative point, for re-submitting later.
     """
-    json_body = [
+    narrative = [
         {
             "measurement": "weather_forecast",
             "fields": {
@@ -41,25 +202,39 @@ def write_to_influx(client: InfluxDBClient, forecast_data: dict) -> None:
             },
         }
     ]
-    client.write_points(json_body)
+    writer.write([dict(p) for p in narrative] + daily_points(forecast_data))
+    return narrative
 
 
-def main():
-    influx_client = InfluxDBClient(
-        host=os.getenv("INFLUX_HOSTNAME"),
-        port=8086,
-        username=os.getenv("INFLUX_USERNAME"),
-        password=os.getenv("INFLUX_PASSWORD"),
-        database=os.getenv("INFLUX_DATABASE"),
-    )
+def poll_once(writer: BatchWriter, state: ForecastState) -> None:
+    """
+    Fetches the forecast for the configured location and writes it.
 
-    while True:
-        weather_api_key = os.getenv("WEATHER_API_KEY")
-        home_geocode = os.getenv("HOME_LATLONG")
+    An unchanged forecast only re-submits the narrative point, which the
+    writer's deadband stage drops until its heartbeat is due.
+
+    Args:
+        writer (BatchWriter): Shared InfluxDB writer.
+        state (ForecastState): Cache and last narrative from earlier calls.
+    """
+    weather_api_key = os.getenv("WEATHER_API_KEY")
+    home_geocode = os.getenv("HOME_LATLONG")
+    if not weather_api_key or not home_geocode:
+        raise ValueError("WEATHER_API_KEY and HOME_LATLONG must be set")
+
+    forecast_data = get_weather_forecast(state.cache, weather_api_key, home_geocode)
+    if forecast_data is None:
+        writer.write([dict(p) for p in state.last_points])
+        return
+    state.last_points = write_to_influx(writer, forecast_data)
 
-        forecast_data = get_weather_forecast(weather_api_key, home_geocode)
-        write_to_influx(influx_client, forecast_data)
 
+def main():
+    writer = create_writer()
+    state = ForecastState()
+
+    while True:
+        poll_once(writer, state)
         time.sleep(600)
 
 
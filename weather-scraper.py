@@ -1,11 +1,75 @@
-""" 
-Scrapes AmbientWeather station for current conditions and writes to InfluxDB.
+"""
+Collects AmbientWeather station conditions and writes to InfluxDB.
+
+By default the station's ``livedata.htm`` page is polled into the ``weather``
+measurement. With ``WEATHER_MODE=push`` a local HTTP listener instead receives
+the readings the station uploads with its "Customized" (custom server)
+setting, in the AmbientWeather protocol, at the station's own rate. Uploads
+are always in imperial units whatever the station displays, so they are
+written to ``weather_push`` under their protocol parameter names rather than
+mixed into the ``weather`` series.
 """
 
 import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
 import requests
-from lxml import html
-from influxdb import InfluxDBClient
+from lxml import etree, html
+from influx_writer import BatchWriter, create_writer
+from scheduling import FixedRateTicker
+
+# Output key -> name of the <input> holding it on livedata.htm
+LIVEDATA_INPUTS = {
+    "inBattery": "inBattSta",
+    "outBattery": "outBattSta1",
+    "inTemp": "inTemp",
+    "inHumid": "inHumi",
+    "absPressure": "AbsPress",
+    "relPressure": "RelPress",
+    "outTemp": "outTemp",
+    "outHumid": "outHumi",
+    "windDir": "windir",
+    "windSpeed": "avgwind",
+    "windGust": "gustspeed",
+    "solarRadiation": "solarrad",
+    "uv": "uv",
+    "uvi": "uvi",
+    "rainHourly": "rainofhourly",
+}
+
+PUSH_MEASUREMENT = "weather_push"
+
+# AmbientWeather push protocol parameters, each written as the field of the
+# same name: °F, %, degrees, mph, mph, W/m², UV index, in/h.
+PUSH_FIELDS = (
+    "tempf",
+    "humidity",
+    "winddir",
+    "windspeedmph",
+    "windgustmph",
+    "solarradiation",
+    "uv",
+    "hourlyrainin",
+)
+
+_named_inputs = etree.XPath("//input[@name]")
+_session = requests.Session()
+
+
+def parse_livedata(content: bytes) -> dict:
+    """
+    Collects every named input of the live data page in one pass.
+
+    Args:
+        content (bytes): The ``livedata.htm`` page.
+
+    Returns:
+        dict: Input name to value.
+    """
+    return {
+        element.get("name"): element.get("value")
+        for element in _named_inputs(html.fromstring(content))
+    }
 
 
 def scrape_weather_data(station_ip: str) -> dict:
@@ -18,36 +82,17 @@ def scrape_weather_data(station_ip: str) -> dict:
     Returns:
         dict: Scraped weather data.
     """
-    page = requests.get(f"http://{station_ip}/livedata.htm")
-    tree = html.fromstring(page.content)
-
-    weather_data = {
-        "inBattery": tree.xpath('//input[@name="inBattSta"]/@value')[0],
-        "outBattery": tree.xpath('//input[@name="outBattSta1"]/@value')[0],
-        "inTemp": tree.xpath('//input[@name="inTemp"]/@value')[0],
-        "inHumid": tree.xpath('//input[@name="inHumi"]/@value')[0],
-        "absPressure": tree.xpath('//input[@name="AbsPress"]/@value')[0],
-        "relPressure": tree.xpath('//input[@name="RelPress"]/@value')[0],
-        "outTemp": tree.xpath('//input[@name="outTemp"]/@value')[0],
-        "outHumid": tree.xpath('//input[@name="outHumi"]/@value')[0],
-        "windDir": tree.xpath('//input[@name="windir"]/@value')[0],
-        "windSpeed": tree.xpath('//input[@name="avgwind"]/@value')[0],
-        "windGust": tree.xpath('//input[@name="gustspeed"]/@value')[0],
-        "solarRadiation": tree.xpath('//input[@name="solarrad"]/@value')[0],
-        "uv": tree.xpath('//input[@name="uv"]/@value')[0],
-        "uvi": tree.xpath('//input[@name="uvi"]/@value')[0],
-        "rainHourly": tree.xpath('//input[@name="rainofhourly"]/@value')[0],
-    }
-
-    return weather_data
+    page = _session.get(f"http://{station_ip}/livedata.htm", timeout=10)
+    inputs = parse_livedata(page.content)
+    return {key: inputs[name] for key, name in LIVEDATA_INPUTS.items()}
 
 
-def write_to_influx(client: InfluxDBClient, weather_data: dict) -> None:
+def write_to_influx(writer: BatchWriter, weather_data: dict) -> None:
     """
     Writes weather data to InfluxDB.
 
     Args:
-        client (InfluxDBClient): InfluxDB client instance.
+        writer (BatchWriter): Shared InfluxDB writer.
         weather_data (dict): Weather data to write.
     """
     json_body = [
@@ -66,22 +111,89 @@ def write_to_influx(client: InfluxDBClient, weather_data: dict) -> None:
             },
         }
     ]
-    client.write_points(json_body)
+    writer.write(json_body)
 
 
-def main():
+def poll_once(writer: BatchWriter) -> None:
+    """
+    Scrapes the configured station once and writes the reading.
+
+    Args:
+        writer (BatchWriter): Shared InfluxDB writer.
+    """
     station_ip = os.getenv("WEATHER_STATION_IP")
+    if not station_ip:
+        raise ValueError("WEATHER_STATION_IP must be set")
     weather_data = scrape_weather_data(station_ip)
+    write_to_influx(writer, weather_data)
+
 
-    influx_client = InfluxDBClient(
-        host=os.getenv("INFLUX_HOSTNAME"),
-        port=8086,
-        username=os.getenv("INFLUX_USERNAME"),
-        password=os.getenv("INFLUX_PASSWORD"),
-        database=os.getenv("INFLUX_DATABASE"),
-    )
+def parse_push(path: str) -> dict:
+    """
+    Converts an AmbientWeather push request into ``weather_push`` fields.
+
+    Stations append the parameters to the configured path either after a
+    ``?`` or, with some firmware, after a bare ``&``.
+
+    Args:
+        path (str): Request path including the query string.
+
+    Returns:
+        dict: Fields present in the upload.
+    """
+    separators = [i for i in (path.find("?"), path.find("&")) if i >= 0]
+    if not separators:
+        return {}
+    params = dict(parse_qsl(path[min(separators) + 1 :]))
+    fields = {}
+    for param in PUSH_FIELDS:
+        try:
+            fields[param] = float(params[param])
+        except (KeyError, ValueError):
+            continue
+    return fields
+
+
+def serve_push(writer: BatchWriter, port: int) -> None:
+    """
+    Runs the custom server listener until interrupted.
 
-    write_to_influx(influx_client, weather_data)
+    Args:
+        writer (BatchWriter): Shared InfluxDB writer.
+        port (int): Port configured as the station's custom server port.
+    """
+
+    class PushHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            fields = parse_push(self.path)
+            if fields:
+                writer.write([{"measurement": PUSH_MEASUREMENT, "fields": fields}])
+            self.send_response(200 if fields else 400)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    with ThreadingHTTPServer(("", port), PushHandler) as server:
+        print(f"Listening for weather station uploads on port {port}")
+        server.serve_forever()
+
+
+def main():
+    writer = create_writer()
+
+    if os.getenv("WEATHER_MODE", "poll") == "push":
+        serve_push(writer, int(os.getenv("WEATHER_PUSH_PORT", 8080)))
+        return
+
+    ticker = FixedRateTicker(float(os.getenv("WEATHER_INTERVAL", 60)))
+    while True:
+        ticker.wait()
+        try:
+            poll_once(writer)
+        except Exception as e:
+            print(f"Weather station poll failed: {e}")
 
 
 if __name__ == "__main__":